@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+
+import main
+import distance_field
+import map_sim_gen as msgen
+from benchmark import TRAJECTORIES, expand_trajectory
+
+'''
+Runs many independent agents on one generated map across a process pool
+The map is generated once in the parent; each worker receives the polygons and distance field once (pool initializer)
+and reuses one headless Simulation for every agent it is given
+Run: python batch_sim.py --map scan1_livingroom --agents 64 --out metrics.json
+'''
+
+# Per worker state set up by init_worker
+worker_sim = None
+worker_field = None
+
+def init_worker(poly_list, field):
+
+    global worker_sim, worker_field
+
+    worker_sim = main.Simulation(headless=True, poly_list=poly_list)
+    # True clearance for the metrics (the lidar only samples 180 directions)
+    worker_field = field
+
+'''
+agent => dict with "start" (x, y), "script" (per frame movement list), "strength" (0/3/6) and optional "frames"
+Returns the agent's metrics
+'''
+def run_agent(agent):
+
+    sim = worker_sim
+    user_obj = sim.user_obj
+
+    user_obj.pos = tuple(agent["start"])
+    user_obj.set_script(agent["script"])
+    sim.control_strength = agent["strength"]
+    sim.curve_pts = np.empty((0, 2))
+
+    max_frames = agent.get("frames", len(agent["script"]))
+    path_length = 0.0
+    collisions = 0
+    collision_frames = 0
+    in_collision = False
+    min_clearance = math.inf
+    clearance_sum = 0.0
+    frames = 0
+
+    start = time.perf_counter()
+    while frames < max_frames:
+        prev_pos = user_obj.pos
+        sim.pathfinder_logic()
+
+        if user_obj.script_done:
+            break
+        frames += 1
+
+        path_length += math.hypot(user_obj.pos[0] - prev_pos[0], user_obj.pos[1] - prev_pos[1])
+
+        # Clearance between the user's circle and the nearest wall
+        clearance = float(worker_field.distance(user_obj.pos)) - sim.USER_RADIUS
+        min_clearance = min(min_clearance, clearance)
+        clearance_sum += clearance
+
+        # A collision is counted each time the user's circle starts overlapping a wall
+        colliding = clearance < 0
+        if colliding:
+            collision_frames += 1
+            if not in_collision:
+                collisions += 1
+        in_collision = colliding
+
+    wall_time = time.perf_counter() - start
+
+    return {
+        "id": agent.get("id"), "start": list(agent["start"]), "strength": agent["strength"], "script": agent.get("script_name"),
+        "frames": frames, "sim_seconds": frames / sim.FPS, "wall_seconds": wall_time,
+        "collisions": collisions, "collision_frames": collision_frames, "path_length": path_length,
+        "min_clearance": min_clearance if frames else None, "mean_clearance": clearance_sum / frames if frames else None,
+        "final_pos": [float(user_obj.pos[0]), float(user_obj.pos[1])],
+    }
+
+# field => distance_field.Distance_Field of the map (e.g. from Sim_Map_Generator.gen_distance_field), built here if None
+def run_batch(poly_list, agents, workers=None, field=None):
+
+    if not poly_list:
+        raise ValueError("No wall polygons to run the batch on (was the map image found?)")
+
+    field = distance_field.Distance_Field(poly_list) if field is None else field
+    workers = workers or os.cpu_count() or 1
+    # Hand each worker a few agents at a time to keep scheduling overhead low without starving workers
+    chunksize = max(1, len(agents) // (workers * 4))
+
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(poly_list, field)) as pool:
+        return pool.map(run_agent, agents, chunksize=chunksize)
+
+# Random start positions at least min_clearance away from every wall (within the screen area)
+def sample_starts(poly_list, count, min_clearance, width, height, seed=0, field=None):
+
+    if not poly_list:
+        raise ValueError("No wall polygons to sample start positions against (was the map image found?)")
+
+    field = distance_field.Distance_Field(poly_list) if field is None else field
+    rng = np.random.default_rng(seed)
+    starts = []
+
+    while len(starts) < count:
+        candidates = rng.uniform((0, 0), (width, height), size=(count * 4, 2))
+        free = candidates[field.distance(candidates) >= min_clearance]
+        starts.extend(tuple(map(float, pt)) for pt in free[:count - len(starts)])
+
+    return starts
+
+# Every combination of start position, script and assistance strength
+def make_agents(starts, scripts, strengths, frames=None):
+
+    agents = []
+    for idx, (start, (script_name, script), strength) in enumerate(itertools.product(starts, scripts.items(), strengths)):
+        agent = {"id": idx, "start": start, "script": script, "script_name": script_name, "strength": strength}
+
+        if frames is not None:
+            agent["frames"] = frames
+        agents.append(agent)
+
+    return agents
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Batch evaluation of the assistance policy")
+    parser.add_argument("--map", choices=sorted(main.MAP_CONFIGS), default="scan1_livingroom")
+    parser.add_argument("--starts", type=int, default=8, help="number of random start positions")
+    parser.add_argument("--strengths", type=int, nargs="+", default=[0, 3, 6], help="assistance strengths to evaluate")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write per agent metrics JSON here")
+    args = parser.parse_args()
+
+    map_path, map_params = main.MAP_CONFIGS[args.map]
+    map_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), map_path) # MAP_CONFIGS paths are relative to the repo
+    generator = msgen.Sim_Map_Generator(map_path, **map_params)
+    poly_list = generator.gen_map_polys()
+    field = generator.gen_distance_field(2.0) # Cached with the map, so repeat runs skip the EDT
+
+    scripts = {name: expand_trajectory(steps) for name, steps in TRAJECTORIES.items()}
+    starts = sample_starts(poly_list, args.starts, 40, map_params["screen_width"], map_params["screen_height"], args.seed, field)
+    agents = make_agents(starts, scripts, args.strengths)
+
+    start = time.perf_counter()
+    metrics = run_batch(poly_list, agents, args.workers, field)
+    elapsed = time.perf_counter() - start
+
+    sim_seconds = sum(m["sim_seconds"] for m in metrics)
+    print(f"{len(agents)} agents, {sim_seconds:.0f} simulated s in {elapsed:.1f} s ({len(agents) / elapsed:.1f} agents/s)", file=sys.stderr)
+    for strength in args.strengths:
+        group = [m for m in metrics if m["strength"] == strength]
+        print(f"strength {strength}: collisions {sum(m['collisions'] for m in group)}, "
+              f"mean path {np.mean([m['path_length'] for m in group]):.0f} px, "
+              f"min clearance {min(m['min_clearance'] for m in group):.1f} px", file=sys.stderr)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(metrics, f, indent=2)
@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import numpy as np
+import pygame
+
+import main
+import sensor_sim
+import map_sim_gen as msgen
+import session_log
+
+'''
+Per stage benchmark of the simulation pipeline
+Run: python benchmark.py --out results.json
+Compare against an earlier run: python benchmark.py --compare results.json
+'''
+
+# Fixed user trajectories as (left, right, up, down) flags and frame counts
+TRAJECTORIES = {
+    "square": [("0100", 90), ("0001", 60), ("1000", 90), ("0010", 60)],
+    "diagonal": [("0101", 60), ("1010", 60), ("0110", 60), ("1001", 60)],
+}
+
+RAY_COUNTS = [90, 180, 360, 720]
+LIDAR_BACKENDS = ["shapely", "numpy", "sphere", "grid"]
+SKEL_MODES = ["morph", "morph_prealloc", "thinning"]
+
+def expand_trajectory(steps):
+
+    script = []
+    for flags, frames in steps:
+        script.extend([[c == '1' for c in flags]] * frames)
+
+    return script
+
+def summarize(times):
+
+    ms = np.asarray(times) * 1000
+    return {"n": len(ms), "mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)), "min_ms": float(ms.min())}
+
+def timed(func, *args, **kwargs):
+
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+# Map generation with the on-disk cache disabled so every stage actually runs
+def bench_map_gen(map_name, repeats):
+
+    map_path, map_params = main.MAP_CONFIGS[map_name]
+    stage_times = {}
+    total_times = []
+
+    for _ in range(repeats):
+        generator = msgen.Sim_Map_Generator(map_path, **map_params, cache_dir=None)
+        elapsed, polys = timed(generator.gen_map_polys)
+        total_times.append(elapsed)
+
+        for stage, stage_time in generator.stage_times.items():
+            stage_times.setdefault(stage, []).append(stage_time)
+
+    results = [{"stage": "map_gen", "variant": stage, **summarize(times)} for stage, times in stage_times.items()]
+    results.append({"stage": "map_gen", "variant": "total", **summarize(total_times),
+                    **generator.poly_counts(polys), "poly_stats": generator.poly_stats})
+
+    return results
+
+# Every skeleton mode on the same preprocessed image, with its pass count
+def bench_skeleton(map_name, repeats):
+
+    map_path, map_params = main.MAP_CONFIGS[map_name]
+    generator = msgen.Sim_Map_Generator(map_path, **map_params, cache_dir=None)
+    preproc_img = generator.preproc_img(generator.load_img(map_path))
+    results = []
+
+    for mode in SKEL_MODES:
+        times = []
+        for _ in range(repeats):
+            generator.gen_skeleton(preproc_img, mode)
+            times.append(generator.skel_stats["time"])
+
+        results.append({"stage": "skeleton", "variant": mode, **summarize(times), "iterations": generator.skel_stats["iterations"]})
+
+    return results
+
+# Replays a trajectory headless and records what each frame saw
+def record_trajectory(sim, frames):
+
+    recorded = []
+    for _ in range(frames):
+        lidar_pts = sim.pathfinder_logic()
+        recorded.append((sim.user_obj.pos, list(sim.user_obj.movement), lidar_pts, sim.curve_pts))
+
+    return recorded
+
+def bench_lidar(sim, recorded, samples):
+
+    results = []
+    positions = [frame[0] for frame in recorded[::max(1, len(recorded) // samples)]]
+
+    for backend in LIDAR_BACKENDS:
+        field = sim.map_generator.gen_distance_field(2.0) if backend == "sphere" else None
+        grid = sim.map_generator.gen_occupancy_grid(2.0) if backend == "grid" else None
+        lidar = sensor_sim.LiDAR_Sensor(sim.user_obj, sim.LiDAR_RANGE, sim.LiDAR_FOV, 4500, backend=backend, distance_field=field, occupancy_grid=grid)
+
+        for num_rays in RAY_COUNTS:
+            # The sphere and grid backends never look at the polygons, so the index makes no difference to them
+            for use_index in ((False,) if backend in ("sphere", "grid") else (False, True)):
+                index = sim.obj_index if use_index else None
+                times = []
+
+                for pos in positions:
+                    sim.user_obj.pos = pos
+                    lidar.reset() # Time a fresh scan even if the sampled position repeats
+                    elapsed, _ = timed(lidar.simulate, num_rays, sim.obj_list, index)
+                    times.append(elapsed)
+
+                variant = f"{backend}/{num_rays}" + ("/index" if use_index else "")
+                results.append({"stage": "lidar.simulate", "variant": variant, **summarize(times)})
+
+    return results
+
+def bench_planner(sim, recorded):
+
+    pathfinder = sim.pathfinder
+    variants = {
+        "loop": (pathfinder.compute_path, pathfinder.compute_repulsion_control_pt),
+        "numpy": (pathfinder.compute_path_np, pathfinder.compute_repulsion_control_pt_np),
+    }
+    results = []
+
+    for variant, (compute_path, compute_repulsion) in variants.items():
+        path_times, repulsion_times = [], []
+
+        for pos, movement, lidar_pts, _ in recorded:
+            elapsed, path = timed(compute_path, user_pos=pos, lidar_pts=lidar_pts, lidar_range=sim.LiDAR_RANGE, user_movement=movement)
+            path_times.append(elapsed)
+
+            elapsed, _ = timed(compute_repulsion, user_pos=pos, desired_dir=path[0], lidar_pts=lidar_pts, avoid_thresh=30, repulsion_factor=0.5)
+            repulsion_times.append(elapsed)
+
+        results.append({"stage": "compute_path", "variant": variant, **summarize(path_times)})
+        results.append({"stage": "compute_repulsion_control_pt", "variant": variant, **summarize(repulsion_times)})
+
+    slowdown_times = [timed(sim.compute_slowdown, lidar_pts, pos, sim.LiDAR_RANGE)[0] for pos, _, lidar_pts, _ in recorded]
+    results.append({"stage": "compute_slowdown", "variant": "default", **summarize(slowdown_times)})
+
+    return results
+
+# Renders into an off screen surface so no display is needed
+def bench_render(sim, recorded):
+
+    sim.screen = pygame.Surface((sim.WIDTH, sim.HEIGHT))
+    times = []
+
+    for pos, _, lidar_pts, curve_pts in recorded:
+        sim.user_obj.pos = pos
+        sim.curve_pts = curve_pts
+        sim.cam.update()
+        elapsed, _ = timed(sim.render_world, lidar_pts)
+        times.append(elapsed)
+
+    return [{"stage": "render", "variant": "world", **summarize(times)}]
+
+# The planner alone on a recorded session, fed the recorded scans instead of scanning (see Simulation.run_replay)
+def bench_session(session_path):
+
+    map_name = session_log.read_meta(session_path).get("map") or "scan1_livingroom"
+    sim = main.Simulation(headless=True, map_name=map_name)
+    stats = sim.run_replay(session_path)
+
+    return map_name, [{"stage": "plan", "variant": "replay", **summarize(stats["plan_times"]), "max_curve_diff": stats["max_curve_diff"]}]
+
+# Run in a fresh interpreter per sample: import main, build a headless Simulation, report how long each part took
+STARTUP_SNIPPET = """
+import sys, time, json
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.Simulation(headless=True, map_name=sys.argv[1])
+ready = time.perf_counter()
+print(json.dumps({"import": imported - start, "init": ready - imported, "cv2": "cv2" in sys.modules}))
+"""
+
+'''
+Cold start with the map's polygons already cached (the usual case after the first run), measured from launching
+the interpreter until the Simulation is ready
+'''
+def bench_startup(map_name, repeats):
+
+    map_path, map_params = main.MAP_CONFIGS[map_name]
+    msgen.Sim_Map_Generator(map_path, **map_params).gen_map_polys() # Make sure the cache entry exists
+
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PYGAME_HIDE_SUPPORT_PROMPT": "1"}
+    times = {"process": [], "import": [], "init": []}
+    cv2_loaded = False
+
+    for _ in range(repeats):
+        elapsed, proc = timed(subprocess.run, [sys.executable, "-c", STARTUP_SNIPPET, map_name], cwd=repo_dir, env=env, capture_output=True, text=True, check=True)
+        sample = json.loads(proc.stdout.strip().splitlines()[-1])
+
+        times["process"].append(elapsed)
+        times["import"].append(sample["import"])
+        times["init"].append(sample["init"])
+        cv2_loaded |= sample["cv2"]
+
+    return [{"stage": "startup", "variant": variant, **summarize(stage_times), "cv2_loaded": cv2_loaded} for variant, stage_times in times.items()]
+
+def run_benchmarks(map_names, trajectories, repeats, samples, sessions=()):
+
+    results = []
+
+    for map_name in map_names:
+        for result in bench_map_gen(map_name, repeats) + bench_skeleton(map_name, repeats) + bench_startup(map_name, repeats):
+            results.append({"map": map_name, "trajectory": None, **result})
+
+        for traj_name in trajectories:
+            script = expand_trajectory(TRAJECTORIES[traj_name])
+            sim = main.Simulation(headless=True, input_script=script, map_name=map_name)
+            recorded = record_trajectory(sim, len(script))
+
+            stage_results = bench_lidar(sim, recorded, samples) + bench_planner(sim, recorded) + bench_render(sim, recorded)
+            for result in stage_results:
+                results.append({"map": map_name, "trajectory": traj_name, **result})
+
+            print(f"Finished {map_name}/{traj_name}", file=sys.stderr)
+
+    for session_path in sessions:
+        map_name, stage_results = bench_session(session_path)
+        for result in stage_results:
+            results.append({"map": map_name, "trajectory": "session:" + os.path.basename(os.path.normpath(session_path)), **result})
+
+    return results
+
+def result_id(result):
+
+    return f"{result['map']}/{result['trajectory']}/{result['stage']}/{result['variant']}"
+
+# Flags every stage whose median got slower than the baseline by more than the tolerance
+def compare(results, baseline_path, tolerance):
+
+    with open(baseline_path) as f:
+        baseline = {result_id(result): result for result in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        old = baseline.get(result_id(result))
+
+        if old is None or old["p50_ms"] <= 0:
+            continue
+
+        ratio = result["p50_ms"] / old["p50_ms"]
+        if ratio > 1 + tolerance:
+            regressions.append((result_id(result), old["p50_ms"], result["p50_ms"], ratio))
+
+    for name, old_ms, new_ms, ratio in regressions:
+        print(f"REGRESSION {name}: {old_ms:.3f} ms -> {new_ms:.3f} ms ({ratio:.2f}x)", file=sys.stderr)
+
+    return regressions
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Per stage simulation benchmarks")
+    parser.add_argument("--maps", nargs="+", choices=sorted(main.MAP_CONFIGS), default=sorted(main.MAP_CONFIGS))
+    parser.add_argument("--trajectories", nargs="+", choices=sorted(TRAJECTORIES), default=sorted(TRAJECTORIES))
+    parser.add_argument("--repeats", type=int, default=3, help="map generation runs per map")
+    parser.add_argument("--samples", type=int, default=20, help="positions per trajectory used for the LiDAR benchmarks")
+    parser.add_argument("--sessions", nargs="+", default=[], help="recorded session directories (main.py --record) to benchmark the planner on")
+    parser.add_argument("--out", help="write results JSON here instead of stdout")
+    parser.add_argument("--compare", help="baseline results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed median slowdown before a stage counts as a regression")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.maps, args.trajectories, args.repeats, args.samples, args.sessions)
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "numpy": np.__version__, "pygame": pygame.version.ver, "platform": platform.platform()},
+        "results": results,
+    }
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
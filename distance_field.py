@@ -0,0 +1,125 @@
+import numpy as np
+
+import occupancy_grid
+
+'''
+Euclidean distance transform (EDT) of a polygon map.
+Computed once per map, then "distance to nearest wall" and "gradient away from the wall"
+are a bilinear lookup at any position instead of a loop over the lidar points
+'''
+class Distance_Field:
+
+    def __init__(self, polys, cell_size=2.0, padding=200):
+
+        import cv2
+
+        self.cell_size = cell_size # World pixels per grid cell
+
+        # Grid covers every polygon plus padding so queries near the map border stay accurate
+        coords = np.concatenate([np.asarray(poly, dtype=float) for poly in polys]) if polys else np.zeros((1, 2))
+        self.origin = coords.min(axis=0) - padding
+        extent = coords.max(axis=0) + padding - self.origin
+        self.shape = (int(np.ceil(extent[1] / cell_size)) + 1, int(np.ceil(extent[0] / cell_size)) + 1) # (rows, cols)
+
+        occupied = self.rasterize(polys)
+
+        # Signed distance: positive in free space, negative inside walls so the gradient still points outwards
+        outside = cv2.distanceTransform(np.where(occupied, 0, 255).astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+        inside = cv2.distanceTransform(occupied, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+        self.set_field((outside - inside) * cell_size)
+
+    # Field saved with a cached map (see map_cache.save_distance_field), so neither rasterizing nor cv2 is needed
+    @classmethod
+    def from_field(cls, field, origin, cell_size):
+
+        dist_field = cls.__new__(cls)
+        dist_field.cell_size = cell_size
+        dist_field.origin = np.asarray(origin, dtype=float)
+        dist_field.shape = tuple(field.shape)
+        dist_field.set_field(field)
+
+        return dist_field
+
+    def set_field(self, field):
+
+        self.field = field
+        grad_y, grad_x = np.gradient(self.field, self.cell_size)
+        self.grad_x = grad_x
+        self.grad_y = grad_y
+
+    def rasterize(self, polys):
+
+        return occupancy_grid.rasterize_polys(polys, self.origin, self.cell_size, self.shape)
+
+    # Bilinear lookup of a grid at one position or an (N, 2) array of positions
+    def sample(self, grid, pos):
+
+        pos = np.asarray(pos, dtype=float)
+        cell = (pos - self.origin) / self.cell_size - 0.5
+
+        col = np.clip(cell[..., 0], 0, self.shape[1] - 1.001)
+        row = np.clip(cell[..., 1], 0, self.shape[0] - 1.001)
+        c0 = col.astype(int)
+        r0 = row.astype(int)
+        fc = col - c0
+        fr = row - r0
+
+        top = grid[r0, c0] * (1 - fc) + grid[r0, c0 + 1] * fc
+        bottom = grid[r0 + 1, c0] * (1 - fc) + grid[r0 + 1, c0 + 1] * fc
+
+        return top * (1 - fr) + bottom * fr
+
+    # Distance (in world pixels) to the nearest wall; negative inside walls
+    def distance(self, pos):
+
+        dist = self.sample(self.field, pos)
+
+        # Outside the grid, add the distance back to the grid border
+        pos = np.asarray(pos, dtype=float)
+        low = self.origin + self.cell_size / 2
+        high = self.origin + (np.array(self.shape[::-1]) - 0.5) * self.cell_size
+        outside = np.maximum(np.maximum(low - pos, pos - high), 0)
+
+        return dist + np.hypot(outside[..., 0], outside[..., 1])
+
+    # Unit vector pointing away from the nearest wall ((0, 0) where the field is flat)
+    def gradient(self, pos):
+
+        gx = self.sample(self.grad_x, pos)
+        gy = self.sample(self.grad_y, pos)
+        mag = np.hypot(gx, gy)
+        safe_mag = np.where(mag > 0, mag, 1)
+
+        return np.stack((np.where(mag > 0, gx / safe_mag, 0), np.where(mag > 0, gy / safe_mag, 0)), axis=-1)
+
+    '''
+    Sphere tracing: every ray advances by the distance to the nearest wall, which can never overshoot one
+    Returns the end point of each ray and a mask of rays that hit a wall within max_range
+    '''
+    def sphere_trace(self, origin, angles, max_range, hit_eps=0.5, max_steps=64):
+
+        origin = np.asarray(origin, dtype=float)
+        dirs = np.column_stack((np.cos(angles), np.sin(angles)))
+        t = np.zeros(len(angles))
+        hit = np.zeros(len(angles), dtype=bool)
+        active = np.ones(len(angles), dtype=bool)
+
+        for _ in range(max_steps):
+            if not active.any():
+                break
+
+            dist = self.distance(origin + dirs[active] * t[active, None])
+            newly_hit = dist <= hit_eps
+
+            active_ids = np.flatnonzero(active)
+            hit[active_ids[newly_hit]] = True
+            # Always step at least a fraction of a cell so grazing rays don't stall
+            t[active_ids] += np.where(newly_hit, 0, np.maximum(dist, self.cell_size * 0.25))
+
+            active[active_ids[newly_hit]] = False
+            active &= t < max_range
+
+        hit &= t <= max_range
+        t = np.minimum(t, max_range)
+
+        return origin + dirs * t[:, None], hit
@@ -1,15 +1,31 @@
-# Imports
+# Imports (modules only some runs need, like cv2 behind the map generator, are imported where they are used)
 import pygame
 import math
+import numpy as np
+import time
+import argparse
+import itertools
+import threading
 import user 
-from obstacle import Obst_Rect as Rect
+from obstacle import Obst_Set
 import sensor_sim
 from pathfinder import Pathfinder as pf
 import map_sim_gen as msgen
-
-from shapely.geometry import Polygon
-
-# import map_processor
+import spatial_index
+import render_layers
+import sensor_loop
+import scan_source
+
+import distance_field
+import occupancy_grid
+import profiler
+
+# Map images with the Sim_Map_Generator settings tuned for each
+MAP_CONFIGS = {
+    "scan1_livingroom": ("maps/scan1_livingroom.png", dict(scale=1.0, merge_thresh=5, area_thresh=200, thickness=8, screen_width=1280, screen_height=720, close_kernel_size=(5, 5), close_iter=3, h_thresh=40, min_line_len=20, max_line_gap=15)),
+    "room1": ("maps/room1.jpg", dict(scale=1.0, merge_thresh=5, area_thresh=200, thickness=0, screen_width=1280, screen_height=720, close_kernel_size=(5, 5), close_iter=1, h_thresh=40, min_line_len=20, max_line_gap=15)),
+    "floorplan1": ("maps/floorplan1.png", dict(scale=1.0, merge_thresh=5, area_thresh=200, thickness=8, screen_width=1280, screen_height=720, close_kernel_size=(5, 5), close_iter=3, h_thresh=40, min_line_len=20, max_line_gap=15)),
+}
 
 # Window rendering
 class Camera:
@@ -25,20 +41,46 @@ class Camera:
 
 class Simulation:
 
-    def __init__(self):
-        # Pygame setup
-        pygame.init()
-        pygame.display.set_caption('LiDAR Simulation')
-
+    '''
+    headless => skip the window, font and joystick setup entirely (no display needed)
+    input_script => per frame movement list (see user.load_input_script) used instead of keyboard/joystick input
+    map_name => key of MAP_CONFIGS to generate the walls from
+    rect_map_path => image whose black pixels become rectangle obstacles (map_processor) instead of generated walls
+    poly_list => already generated wall polygons to use instead of running the map generator
+    ros_map_path => map_server YAML (e.g. a map saved on the robot) whose occupied cells become the walls, at its own
+                    origin and resolution; the user starts at the map frame's origin
+    tiled_map_path => binary PGM map too large to load at once (tiled_world.Tiled_World), processed at its native resolution
+                      tile by tile as the user moves; the user starts at its centre
+    grid => occupancy_grid.Occupancy_Grid (e.g. loaded from a mapper) scanned by the "grid" LiDAR backend instead of
+            one rasterized from the walls
+    lidar_backend => LiDAR_Sensor backend, overrides LiDAR_BACKEND
+    lidar_incremental => overrides LiDAR_INCREMENTAL
+    scans => scan_source.Scan_Source to take the lidar hits from (e.g. a real robot's scans) instead of the simulated sensor
+    '''
+    def __init__(self, headless=False, input_script=None, map_name="scan1_livingroom", rect_map_path=None, poly_list=None, ros_map_path=None, tiled_map_path=None, grid=None, lidar_backend=None, lidar_incremental=None, scans=None):
+
+        self.headless = headless
+        self.map_name = map_name if poly_list is None and rect_map_path is None and ros_map_path is None and tiled_map_path is None else None
         self.WIDTH, self.HEIGHT = 1280, 720
+        self.FPS = 60
+        self.SENSOR_RATE = 30 # Hz of the sensor/planner thread in run(); None scans and plans every rendered frame
 
-        self.screen = pygame.display.set_mode((self.WIDTH, self.HEIGHT))
-        self.clock = pygame.time.Clock()
+        # Pygame setup
+        if self.headless:
+            self.screen = None
+            self.clock = None
+            self.font = None
+        else:
+            pygame.init()
+            pygame.display.set_caption('LiDAR Simulation')
+
+            self.screen = pygame.display.set_mode((self.WIDTH, self.HEIGHT))
+            self.clock = pygame.time.Clock()
+            # Variables
+            self.font = pygame.font.SysFont(None, 24)
 
         self.running = True
 
-        # Variables
-        self.font = pygame.font.SysFont(None, 24)
         # Colors
         self.RED = (255,0,0)
         self.WHITE = (255,255,255)
@@ -48,38 +90,84 @@ class Simulation:
         # LiDAR Specs
         self.LiDAR_RANGE = 200 # Measured in pixels
         self.LiDAR_FOV = 360
+        self.LiDAR_BACKEND = lidar_backend or "numpy" # "shapely", "numpy", "sphere" (needs the distance field) or "grid" (needs the occupancy grid)
+        self.LiDAR_INCREMENTAL = bool(lidar_incremental) # Track each ray's hit edge between scans (numpy backend; same hits as a full scan)
+        # Rendering
+        self.PRERENDER_MAP = True # Draw the walls once into cached tiles instead of every polygon every frame
+        # Distance field
+        self.DIST_FIELD_CELL = None # World pixels per distance field cell; None disables the field
+        # Occupancy grid
+        self.GRID_CELL = 2.0 # World pixels per occupancy grid cell rasterized for the "grid" backend
         # Pathing
-        self.curve_pts = []
-
-        # Map generator
-        map_generator = msgen.Sim_Map_Generator("maps/scan1_livingroom.png", scale=1.0, merge_thresh=5, area_thresh=200, thickness=8, screen_width=1280, screen_height=720, close_kernel_size=(5, 5), close_iter=3, h_thresh=40, min_line_len=20, max_line_gap=15)
-        # map_generator = msgen.Sim_Map_Generator("maps/room1.jpg", scale=1.0, merge_thresh=5, area_thresh=200, thickness=0, screen_width=1280, screen_height=720, close_kernel_size=(5, 5), close_iter=1, h_thresh=40, min_line_len=20, max_line_gap=15)
-        poly_list = map_generator.gen_map_polys()
+        self.curve_pts = np.empty((0, 2))
+        self.min_distance = self.LiDAR_RANGE # Clearance used by the last planning step
+        self.plan_pos = None # Position and movement the last planning step ran with
+        self.plan_movement = None
+        self.sector_bounds_cache = {}
 
         # Instantiate objects
-        self.obj_list = []
-
-        # Tight corner hallway list of polygons
-        # poly_list = [
-        #     [(0, -250), (100, -250), (100, 600), (0, 600)],
-        #     [(200, -250), (300, -250), (300, 550), (200, 550)],
-        #     [(0, 600), (600, 600), (600, 700), (0, 700)],
-        # ]
-
-        poly_list = [Polygon(pts).exterior.coords for pts in poly_list]
-
-        for poly in poly_list:
-            obs = Rect((0, 0), (0, 0)) 
-            obs.poly = poly 
-            obs.shapely_poly = Polygon(poly)
-            self.obj_list.append(obs)
-
-        self.user_obj = user.User((self.WIDTH // 2, self.HEIGHT // 2), self.USER_SPEED)
-        self.lidar = sensor_sim.LiDAR_Sensor(self.user_obj, self.LiDAR_RANGE, self.LiDAR_FOV, 4500)
+        self.obj_list = Obst_Set.from_polys([])
+        self.ros_map = None
+        self.world = None # tiled_world.Tiled_World streaming the walls in around the user
+        self.start_pos = (self.WIDTH // 2, self.HEIGHT // 2)
+
+        if poly_list is not None:
+            self.map_generator = None
+            self.load_polys(poly_list)
+        elif rect_map_path is not None:
+            self.load_rect_map(rect_map_path)
+        elif ros_map_path is not None:
+            self.load_ros_map(ros_map_path)
+        elif tiled_map_path is not None:
+            self.load_tiled_map(tiled_map_path)
+        else:
+            self.load_generated_map(map_name)
+
+        # Spatial index over the (static) obstacles so scans only test walls near the user
+        self.obj_index = self.world.index if self.world is not None else spatial_index.Spatial_Grid(self.obj_list, cell_size=self.LiDAR_RANGE)
+        self.map_layer = None # Built on the first render so headless runs never draw the walls
+        self.point_layer = None
+
+        # Optional Euclidean distance field of the walls for constant time clearance queries
+        self.dist_field = None
+        if self.DIST_FIELD_CELL is not None or self.LiDAR_BACKEND == "sphere":
+            cell_size = self.DIST_FIELD_CELL or 2.0
+            if self.map_generator is not None:
+                self.dist_field = self.map_generator.gen_distance_field(cell_size)
+            else:
+                self.dist_field = distance_field.Distance_Field(self.obj_list.polys(), cell_size=cell_size)
+
+        # Occupancy grid for the "grid" backend, rasterized from the walls unless one was given
+        self.occ_grid = grid
+        if self.occ_grid is None and self.LiDAR_BACKEND == "grid":
+            if self.ros_map is not None:
+                self.occ_grid = self.ros_map.occupancy_grid()
+            elif self.map_generator is not None:
+                self.occ_grid = self.map_generator.gen_occupancy_grid(self.GRID_CELL)
+            else:
+                self.occ_grid = occupancy_grid.Occupancy_Grid.from_polys(self.obj_list.polys(), cell_size=self.GRID_CELL)
+
+        # Without a display there is no keyboard to poll, so an unscripted headless user stands still
+        if self.headless and input_script is None:
+            input_script = itertools.repeat([False, False, False, False])
+
+        self.user_obj = user.User(self.start_pos, self.USER_SPEED, script=input_script)
+        self.lidar = sensor_sim.LiDAR_Sensor(self.user_obj, self.LiDAR_RANGE, self.LiDAR_FOV, 4500, backend=self.LiDAR_BACKEND, distance_field=self.dist_field, occupancy_grid=self.occ_grid, incremental=self.LiDAR_INCREMENTAL)
+        self.scan_source = scans if scans is not None else scan_source.Sim_Scan_Source(self.lidar, self.obj_list, self.obj_index)
         self.cam = Camera(self.user_obj, (self.WIDTH, self.HEIGHT))
         self.pathfinder = pf()
-        
-        # self.obj_list = map_processor.load_map(map_path)
+
+        # Sensor thread state (set up by start_sensor_loop)
+        self.sensor_loop = None
+        self.sensor_pose = None
+        self.sensor_lidar = None
+        self.sensor_source = None
+        self.scan_lock = None
+        self.latest_scan = None # (lidar_pts, slowdown_dict, curve_pts, min_distance, plan_pos, plan_movement) of the last completed step
+        self.latest_walls = None # (objs, index) of newly streamed in tiles the render loop hasn't picked up yet
+
+        self.recorder = None # session_log.Session_Recorder while recording
+        self.profiler = profiler.Frame_Profiler() # Stage timings; off (next to no overhead) until enabled or F3
 
         # Button Variables
         button_w = 180
@@ -98,6 +186,83 @@ class Simulation:
         # Default to control setting ("Some Assistance")
         self.ctrl_index = 1
         self.control_strength = self.buttons[self.ctrl_index]["strength"]
+
+    # Walls generated from a map image by Sim_Map_Generator
+    def load_generated_map(self, map_name):
+
+        # Map generator
+        map_path, map_params = MAP_CONFIGS[map_name]
+        self.map_generator = msgen.Sim_Map_Generator(map_path, **map_params)
+        poly_list = self.map_generator.gen_map_polys()
+
+        self.load_polys(poly_list)
+
+    def load_polys(self, poly_list):
+
+        # Tight corner hallway list of polygons
+        # poly_list = [
+        #     [(0, -250), (100, -250), (100, 600), (0, 600)],
+        #     [(200, -250), (300, -250), (300, 550), (200, 550)],
+        #     [(0, 600), (600, 600), (600, 700), (0, 700)],
+        # ]
+
+        self.obj_list = Obst_Set.from_polys(poly_list)
+
+    # Rectangles covering the black pixels of an image
+    def load_rect_map(self, map_path):
+
+        import map_processor
+
+        self.map_generator = None
+        self.obj_list = Obst_Set.from_polys([obs.poly for obs in map_processor.load_map(map_path)])
+
+    # Walls from the occupied cells of a map_server map, at the map's real scale
+    def load_ros_map(self, yaml_path):
+
+        import ros_map
+
+        self.map_generator = None
+        self.ros_map = ros_map.Ros_Map(yaml_path)
+        self.load_polys(self.ros_map.wall_polys())
+        self.start_pos = tuple(float(v) for v in self.ros_map.world_to_sim((0, 0)))
+
+    # Only the tiles around the user are loaded, starting with the ones around the map's centre
+    def load_tiled_map(self, map_path):
+
+        # The distance field and occupancy grid backends need the whole map up front
+        if self.LiDAR_BACKEND not in ("numpy", "shapely"):
+            raise ValueError(f"LiDAR backend {self.LiDAR_BACKEND} needs the whole map and can't scan a tiled world")
+
+        import tiled_world
+
+        self.map_generator = None
+        self.world = tiled_world.Tiled_World(map_path, radius=self.LiDAR_RANGE + self.USER_RADIUS, prefetch_radius=2 * self.LiDAR_RANGE)
+        self.start_pos = self.world.center
+        self.world.update(self.start_pos)
+        self.obj_list = self.world.objs
+
+    '''
+    Streams in the tiles around pos and points source (the calling thread's scan source) at their walls
+    Returns the new (objs, index) when the loaded set changed, else None. Only the thread the caller runs on is
+    touched here: the render loop swaps its walls in set_walls, handed over by the sensor thread when it has one
+    '''
+    def update_world(self, pos, source):
+
+        if self.world is None or not self.world.update(pos):
+            return None
+
+        # New objects rather than in place edits, so scans and renders already under way finish on the old walls
+        walls = (self.world.objs, self.world.index)
+        if isinstance(source, scan_source.Sim_Scan_Source):
+            source.objs, source.index = walls
+
+        return walls
+
+    # Walls the renderer draws and culls with, always replaced together so an index never meets another list
+    def set_walls(self, objs, index):
+
+        self.obj_list, self.obj_index = objs, index
+        self.map_layer = None # Redrawn from the new walls
     
     def butt_event_handler(self, event):
 
@@ -122,46 +287,70 @@ class Simulation:
             text_rect = text_surf.get_rect(center=btn["shape"].center)
             self.screen.blit(text_surf, text_rect)
 
+    # Slowdown multiplier for moving left, right, up and down (screen y points down, so "down" is 90 degrees)
     def compute_slowdown(self, lidar_pts, user_pos, lidar_range, factor=0.05, cone_angle=30):
 
-        # Initialize slowdown sums for each direction
-        slowdown_sum = {"left": 0.0, "right": 0.0, "up": 0.0, "down": 0.0}
-
-        for pt in lidar_pts:
-            diff_x = pt[0] - user_pos[0]
-            diff_y = pt[1] - user_pos[1]
-            dist = math.hypot(diff_x, diff_y) # Hypotenuse
-            if dist == 0 or dist > lidar_range:
-                continue
-
-            # Weight is stronger when closer
-            weight = (lidar_range - dist) / lidar_range
-            angle = math.degrees(math.atan2(diff_y, diff_x)) % 360 # Return range from -pi to pi radians
-
-            # Check if the point is within the cone for each direction.
-            # Right: around 0/360 degrees
-            if angle <= cone_angle or angle >= 360 - cone_angle:
-                slowdown_sum["right"] += weight
-            # Left: around 180 degrees
-            if abs(angle - 180) <= cone_angle:
-                slowdown_sum["left"] += weight
-            # Up: obstacles above give an angle around 270 degrees
-            if abs(angle - 270) <= cone_angle:
-                slowdown_sum["up"] += weight
-            # Down: obstacles below give an angle around 90 degrees
-            if abs(angle - 90) <= cone_angle:
-                slowdown_sum["down"] += weight
+        right, down, left, up = self.compute_sector_slowdown(lidar_pts, user_pos, lidar_range, (0, 90, 180, 270), factor, cone_angle)
+
+        return {"left": left, "right": right, "up": up, "down": down}
+
+    '''
+    Slowdown multiplier for any number of directions (sector_angles, degrees) in one pass over the points
+    Point bearings are sorted once into a cumulative histogram of proximity weight, so each sector's cone
+    [angle - cone_angle, angle + cone_angle] is two binary searches no matter how many points or sectors there are
+    The cone edges are cached per sector layout and reused across frames
+    '''
+    def compute_sector_slowdown(self, lidar_pts, user_pos, lidar_range, sector_angles, factor=0.05, cone_angle=30):
+
+        lidar_pts = np.asarray(lidar_pts, dtype=float).reshape(-1, 2)
+        diff_x = lidar_pts[:, 0] - user_pos[0]
+        diff_y = lidar_pts[:, 1] - user_pos[1]
+        dist = np.hypot(diff_x, diff_y) # Hypotenuse
+        in_range = (dist != 0) & (dist <= lidar_range)
+
+        # Weight is stronger when closer
+        weight = (lidar_range - dist[in_range]) / lidar_range
+        angle = np.degrees(np.arctan2(diff_y[in_range], diff_x[in_range])) % 360 # Return range from 0 to 360 degrees
+
+        order = np.argsort(angle)
+        angle = angle[order]
+        cum_weight = np.concatenate(([0.0], np.cumsum(weight[order])))
+
+        # Cone edges are inclusive like the per point check. Rays often land exactly on an edge, so a small tolerance
+        # keeps them counted whichever way the bearing's last digit rounds
+        low, high, wraps = self.sector_bounds(tuple(sector_angles), cone_angle)
+        low_idx = np.searchsorted(angle, low, side='left')
+        high_idx = np.searchsorted(angle, high, side='right')
+
+        slowdown_sum = cum_weight[high_idx] - cum_weight[low_idx]
+        # Cones crossing 0 degrees cover [low, 360) and [0, high]
+        slowdown_sum[wraps] = cum_weight[-1] - cum_weight[low_idx[wraps]] + cum_weight[high_idx[wraps]]
 
         # Calculate slowdown multiplier
-        slowdown = {}
-        for d in slowdown_sum:
-            slowdown[d] = max(0.1, 1 - factor * slowdown_sum[d])
+        return np.maximum(0.1, 1 - factor * slowdown_sum)
+
+    # Cone edges of each sector in [0, 360) and whether the cone wraps past 0 degrees
+    def sector_bounds(self, sector_angles, cone_angle):
 
-        return slowdown
+        key = (sector_angles, cone_angle)
+        if key not in self.sector_bounds_cache:
+            centres = np.asarray(sector_angles, dtype=float) % 360
+
+            if cone_angle >= 180:
+                # Cone covers the full circle
+                low = np.zeros(len(centres))
+                high = np.full(len(centres), 360.0)
+            else:
+                low = (centres - cone_angle - 1e-9) % 360
+                high = (centres + cone_angle + 1e-9) % 360
+
+            self.sector_bounds_cache[key] = (low, high, low > high)
+
+        return self.sector_bounds_cache[key]
 
     def compute_steering_nudge(self, nudge_str):
 
-        if not self.curve_pts:
+        if len(self.curve_pts) == 0:
             return (0, 0)
 
         guiding_idx = min(5, len(self.curve_pts) - 1)
@@ -198,36 +387,65 @@ class Simulation:
         
 
 
+    # One lockstep update: scan, move the user, plan from the new position and nudge the user along the curve
     def pathfinder_logic(self):
 
         # Clear old curve
-        self.curve_pts.clear()
-        lidar_pts = self.lidar.simulate(180, self.obj_list)
+        self.curve_pts = np.empty((0, 2))
+        walls = self.update_world(self.user_obj.pos, self.scan_source)
+        if walls is not None:
+            self.set_walls(*walls)
+        lidar_pts, slowdown_dict = self.sense(self.scan_source, self.user_obj.pos)
+
+        self.move(slowdown_dict)
+
+        self.plan_pos = self.user_obj.pos
+        self.plan_movement = list(self.user_obj.movement)
+        self.curve_pts, self.min_distance = self.plan(lidar_pts, self.plan_pos, self.plan_movement)
+        self.nudge()
+
+        return lidar_pts
+
+    # Take the newest scan from the given source and derive the per direction slowdown from it
+    def sense(self, source, pos):
+
+        with self.profiler.stage("lidar.simulate"):
+            lidar_pts = source.scan(pos)
 
         # Speed Policy
         # Slowdown factors are based on chosen setting. Should scale if option 1 or 2 is chosen
         if self.control_strength == 0:
             slowdown_dict = {'left': 1, 'right': 1, 'up': 1, 'down': 1}
         else:
-            slowdown_dict = self.compute_slowdown(lidar_pts, self.user_obj.pos, self.LiDAR_RANGE)
-        
+            with self.profiler.stage("compute_slowdown"):
+                slowdown_dict = self.compute_slowdown(lidar_pts, pos, self.LiDAR_RANGE)
+
+        return lidar_pts, slowdown_dict
+
+    def move(self, slowdown_dict):
+
         # Update user movement with slowdown
         self.user_obj.input_handler()
         self.user_obj.update(slowdown=slowdown_dict)
 
+    # Returns the guiding curve from user_pos and the clearance it was planned with
+    def plan(self, lidar_pts, user_pos, user_movement):
+
         # Compute the minimum distance from the user to any obstacle
         min_distance = self.LiDAR_RANGE
-        for pt in lidar_pts:
-            dist = math.hypot(pt[0] - self.user_obj.pos[0], pt[1] - self.user_obj.pos[1])
-
-            if dist < min_distance:
-                min_distance = dist
+        if self.dist_field is not None:
+            # Constant time lookup of the true clearance instead of the closest sampled lidar point
+            min_distance = min(self.LiDAR_RANGE, max(0.0, float(self.dist_field.distance(user_pos))))
+        elif len(lidar_pts):
+            min_distance = min(min_distance, float(np.hypot(lidar_pts[:, 0] - user_pos[0], lidar_pts[:, 1] - user_pos[1]).min()))
         
         # Compute the desired path using the Pathfinder class
-        endpt, repulsion_vector, desired_dir, net_vector, net_direction = self.pathfinder.compute_path(user_pos=self.user_obj.pos, lidar_pts=lidar_pts, lidar_range=self.LiDAR_RANGE, user_movement=self.user_obj.movement)
+        with self.profiler.stage("compute_path"):
+            endpt, repulsion_vector, desired_dir, net_vector, net_direction = self.pathfinder.compute_path_np(user_pos=user_pos, lidar_pts=lidar_pts, lidar_range=self.LiDAR_RANGE, user_movement=user_movement)
 
         # Compute bending intensity based on proximity
         threshold = 50
+
         dynamic_bend_intensity = 0.3 + 0.7 * (max(0, (threshold - min_distance)) / threshold)
             
         # Compute the perpendicular vector to the net direction
@@ -236,80 +454,349 @@ class Simulation:
         offset_distance = rep_mag * dynamic_bend_intensity
             
         # Compute the midpoint between the user's position and the endpoint
-        midpt = ((self.user_obj.pos[0] + endpt[0]) / 2, (self.user_obj.pos[1] + endpt[1]) / 2)
+        midpt = ((user_pos[0] + endpt[0]) / 2, (user_pos[1] + endpt[1]) / 2)
             
         # Offset the midpoint along the perpendicular to get the control point
         control_pt = (midpt[0] + offset_distance * perp_vector[0], midpt[1] + offset_distance * perp_vector[1])
             
         # Adjust the control point using curve repulsion
-        repulsion_offset = self.pathfinder.compute_repulsion_control_pt(user_pos=self.user_obj.pos, desired_dir=endpt, lidar_pts=lidar_pts, avoid_thresh=30, repulsion_factor=0.5)
+        with self.profiler.stage("compute_repulsion_control_pt"):
+            repulsion_offset = self.pathfinder.compute_repulsion_control_pt_np(user_pos=user_pos, desired_dir=endpt, lidar_pts=lidar_pts, avoid_thresh=30, repulsion_factor=0.5)
         control_pt = (control_pt[0] + repulsion_offset[0], control_pt[1] + repulsion_offset[1])
 
         # Generate the quadratic Bezier curve
-        self.curve_pts = self.pathfinder.compute_quad_bezier_curve(self.user_obj.pos, control_pt, endpt, num_pts=20)
+        with self.profiler.stage("bezier"):
+            curve_pts = self.pathfinder.compute_quad_bezier_curve_np(user_pos, control_pt, endpt, num_pts=20)
+
+        return curve_pts, min_distance
+
+    # Gently nudge the user towards self.curve_pts. Only move them when user is moving
+    def nudge(self):
 
-        # Gently nudge the user towards the computed path. Only move them when user is moving
         if any(self.user_obj.movement):
-            scaling_factor = (self.LiDAR_RANGE - min_distance) / self.LiDAR_RANGE
+            scaling_factor = (self.LiDAR_RANGE - self.min_distance) / self.LiDAR_RANGE
             nudge_strength = self.control_strength * scaling_factor
             steering_nudge = self.compute_steering_nudge(nudge_strength)     
                 
             # Perform nudging
             self.user_obj.pos = (self.user_obj.pos[0] + steering_nudge[0], self.user_obj.pos[1] + steering_nudge[1])
-        
+
+    '''
+    Sensor loop step (runs on the sensor thread): scans from a snapshot of the user's position, plans from the same
+    snapshot and publishes the results for the render loop to pick up
+    '''
+    def sensor_step(self):
+
+        self.sensor_pose.pos = self.user_obj.pos
+        movement = list(self.user_obj.movement)
+
+        walls = self.update_world(self.sensor_pose.pos, self.sensor_source)
+        lidar_pts, slowdown_dict = self.sense(self.sensor_source, self.sensor_pose.pos)
+        curve_pts, min_distance = self.plan(lidar_pts, self.sensor_pose.pos, movement)
+
+        with self.scan_lock:
+            self.latest_scan = (lidar_pts, slowdown_dict, curve_pts, min_distance, self.sensor_pose.pos, movement)
+            if walls is not None:
+                self.latest_walls = walls
+
+    # Draws the obstacles, lidar points, player and curve (everything but the UI) to self.screen
+    def render_world(self, lidar_pts):
+
+        self.screen.fill((0, 0, 0)) # Clear Screen
+
+        # Render obstacles
+        with self.profiler.stage("render_obstacles"):
+            if self.PRERENDER_MAP:
+                map_layer = self.map_layer
+                if map_layer is None:
+                    map_layer = self.map_layer = render_layers.Static_Map_Layer(self.obj_list)
+                map_layer.render(self.screen, self.cam.pos)
+            else:
+                # Only draw the obstacles whose bounds overlap the view (list and index read as one pair)
+                objs, index = self.obj_list, self.obj_index
+                view = (self.cam.pos[0], self.cam.pos[1], self.cam.pos[0] + self.WIDTH, self.cam.pos[1] + self.HEIGHT)
+                for idx in index.query_bounds(*view):
+                    pts = [(int(x) - self.cam.pos[0], int(y) - self.cam.pos[1]) for (x, y) in objs[idx].poly]
+                    pygame.draw.polygon(self.screen, (0, 0, 255), pts, width=2)
+
+        # Render lidar points (culled to the view and blitted in one batch)
+        with self.profiler.stage("render_points"):
+            if self.point_layer is None:
+                self.point_layer = render_layers.Point_Layer(self.RED, 2)
+            self.point_layer.render(self.screen, lidar_pts, self.cam.pos)
+
+        # Draw player
+        pygame.draw.circle(self.screen, self.WHITE, (self.WIDTH // 2, self.HEIGHT // 2), self.USER_RADIUS)
+
+        # Render the computed Bezier curve
+        if self.control_strength > 0 and len(self.curve_pts) > 1:
+            adjusted_curve = (np.asarray(self.curve_pts) - self.cam.pos).tolist()
+            pygame.draw.lines(self.screen, (0, 255, 0), False, adjusted_curve, 2)
+
+    # Starts scanning and planning at SENSOR_RATE on a background thread
+    def start_sensor_loop(self):
+
+        self.sensor_pose = sensor_loop.Sensor_Pose(self.user_obj.pos)
+        self.scan_lock = threading.Lock()
+
+        # The simulated sensor is only ever used from the thread, with its own sensor bound to a snapshot of the
+        # user's position. Other sources are handed over as they are
+        if isinstance(self.scan_source, scan_source.Sim_Scan_Source):
+            self.sensor_lidar = sensor_sim.LiDAR_Sensor(self.sensor_pose, self.LiDAR_RANGE, self.LiDAR_FOV, 4500, backend=self.LiDAR_BACKEND, distance_field=self.dist_field, occupancy_grid=self.occ_grid, incremental=self.LiDAR_INCREMENTAL)
+            self.sensor_source = scan_source.Sim_Scan_Source(self.sensor_lidar, self.scan_source.objs, self.scan_source.index, self.scan_source.num_rays)
+        else:
+            self.sensor_source = self.scan_source
+
+        # First step runs here so the render loop always has a scan to draw
+        self.sensor_step()
+
+        self.sensor_loop = sensor_loop.Fixed_Rate_Loop(self.sensor_step, self.SENSOR_RATE)
+        self.sensor_loop.start()
+
+    # Moves the user with the latest completed sensor step and returns its scan
+    def apply_latest_scan(self):
+
+        self.sensor_loop.check()
+
+        with self.scan_lock:
+            lidar_pts, slowdown_dict, self.curve_pts, self.min_distance, self.plan_pos, self.plan_movement = self.latest_scan
+            walls, self.latest_walls = self.latest_walls, None
+
+        if walls is not None:
+            self.set_walls(*walls)
+
+        self.move(slowdown_dict)
+        self.nudge()
+
         return lidar_pts
 
+    def render_rates(self):
+
+        render_rate = self.clock.get_fps()
+        sensor_rate = self.sensor_loop.rate() if self.sensor_loop is not None else render_rate
+
+        text_surf = self.font.render(f"Render {render_rate:.0f} Hz  Sensor {sensor_rate:.0f} Hz", True, self.WHITE)
+        self.screen.blit(text_surf, (10, 10))
+
     def run(self):
 
+        if self.SENSOR_RATE is not None:
+            self.start_sensor_loop()
 
-        while self.running:
-            for event in pygame.event.get():
+        try:
+            while self.running:
+                frame_start = time.perf_counter()
 
-                if event.type == pygame.QUIT:
-                    self.running = False
-                else:
-                    self.butt_event_handler(event)
+                for event in pygame.event.get():
 
-            # Simulate Lidar and adjust speed based on proximity to any object
+                    if event.type == pygame.QUIT:
+                        self.running = False
+                    elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                        self.profiler.toggle_overlay()
+                    else:
+                        self.butt_event_handler(event)
+
+                # Simulate Lidar and adjust speed based on proximity to any object
+                if self.sensor_loop is not None:
+                    lidar_pts = self.apply_latest_scan()
+                else:
+                    lidar_pts = self.pathfinder_logic()
+                self.record_frame(lidar_pts)
+
+                # Camera to 'correct' positioning of render
+                self.cam.update()
+
+                # Render
+                self.render_world(lidar_pts)
+
+                # Render control buttons
+                self.render_butts()
+                self.render_rates()
+                self.profiler.render(self.screen)
+
+                pygame.display.update()
+
+                # Work per frame, without the wait for the next one
+                if self.profiler.enabled:
+                    self.profiler.add("frame", time.perf_counter() - frame_start)
+                self.profiler.tick()
+                self.clock.tick(self.FPS)
+        finally:
+            if self.sensor_loop is not None:
+                self.sensor_loop.stop()
+                self.sensor_loop = None
+
+    '''
+    Runs the assistance logic without a display as fast as possible
+    Stops when the input script or the scan source runs out, or after max_frames frames (whichever is first)
+    '''
+    def run_headless(self, max_frames=None):
+
+        frames = 0
+        start = time.perf_counter()
+
+        while self.running and (max_frames is None or frames < max_frames):
+            frame_start = time.perf_counter()
             lidar_pts = self.pathfinder_logic()
 
-            # Camera to 'correct' positioning of render
-            self.cam.update()
+            if self.user_obj.script_done or self.scan_source.done:
+                break
+            self.record_frame(lidar_pts)
+            frames += 1
 
-            # Render
-            self.screen.fill((0, 0, 0)) # Clear Screen
+            if self.profiler.enabled:
+                self.profiler.add("frame", time.perf_counter() - frame_start)
+            self.profiler.tick()
 
-            # Render obstacles
-            # for obj in self.obj_list:
-            #     obj.render(self.screen, self.cam.pos, True)
-            for obj in self.obj_list:
-                # Check if the obstacle has a polygon attribute
-                if hasattr(obj, 'poly'):
-                    pts = [(int(x) - self.cam.pos[0], int(y) - self.cam.pos[1]) for (x, y) in obj.poly]
-                    pygame.draw.polygon(self.screen, (0, 0, 255), pts, width=2)
+        wall_time = time.perf_counter() - start
 
-            # Render lidar points
-            for pt in lidar_pts:
-                adjusted_pt = (pt[0] - self.cam.pos[0], pt[1] - self.cam.pos[1])
-                pygame.draw.circle(self.screen, self.RED, adjusted_pt, 2) 
+        return {"frames": frames, "sim_seconds": frames / self.FPS, "wall_seconds": wall_time, "final_pos": self.user_obj.pos}
 
-            # Draw player
-            pygame.draw.circle(self.screen, self.WHITE, (self.WIDTH // 2, self.HEIGHT // 2), self.USER_RADIUS)
+    # Logs every following frame to a session directory (see session_log)
+    def start_recording(self, path):
 
-            # Render the computed Bezier curve
-            if self.control_strength > 0 and self.curve_pts:
-                adjusted_curve = [(pt[0] - self.cam.pos[0], pt[1] - self.cam.pos[1]) for pt in self.curve_pts]
-                for i in range(len(adjusted_curve) - 1):
-                    pygame.draw.line(self.screen, (0, 255, 0), adjusted_curve[i], adjusted_curve[i + 1], 2)
+        import session_log
 
-            # Render control buttons
-            self.render_butts()
+        meta = {"map": self.map_name, "fps": self.FPS, "lidar_range": self.LiDAR_RANGE, "lidar_backend": self.LiDAR_BACKEND}
+        self.recorder = session_log.Session_Recorder(path, meta)
 
-            pygame.display.update()
-            self.clock.tick(60)      
+    def stop_recording(self):
 
-if __name__ == "__main__":
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def record_frame(self, lidar_pts):
 
-    Simulation().run()
+        if self.recorder is not None:
+            self.recorder.record(self.user_obj.pos, self.plan_pos, self.plan_movement, self.control_strength, lidar_pts, self.curve_pts)
 
-    pygame.quit()
\ No newline at end of file
+    '''
+    Feeds a recorded session back through the planner (and the renderer unless headless) without scanning
+    Returns the planner time of every frame and how far the replanned curves drifted from the recorded ones
+    '''
+    def run_replay(self, path):
+
+        import session_log
+
+        replay = session_log.Session_Replay(path)
+        plan_times = []
+        max_curve_diff = 0.0
+
+        for frame in replay:
+            if not self.headless:
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        self.running = False
+
+            if not self.running:
+                break
+
+            self.control_strength = frame["strength"]
+            lidar_pts = frame["lidar"]
+
+            start = time.perf_counter()
+            self.curve_pts, self.min_distance = self.plan(lidar_pts, tuple(frame["plan_pos"]), frame["movement"].tolist())
+            plan_times.append(time.perf_counter() - start)
+
+            if len(self.curve_pts) == len(frame["curve"]):
+                if len(self.curve_pts):
+                    max_curve_diff = max(max_curve_diff, float(np.abs(self.curve_pts - frame["curve"]).max()))
+            else:
+                max_curve_diff = math.inf
+
+            self.user_obj.pos = tuple(frame["pos"])
+
+            if not self.headless:
+                self.cam.update()
+                self.render_world(lidar_pts)
+                self.render_butts()
+                pygame.display.update()
+                self.clock.tick(self.FPS)
+
+        return {"frames": len(plan_times), "plan_times": plan_times, "max_curve_diff": max_curve_diff}
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="LiDAR assistance simulation")
+    parser.add_argument("--headless", action="store_true", help="run without a window as fast as possible")
+    parser.add_argument("--script", help="input script to replay instead of keyboard/joystick input")
+    parser.add_argument("--frames", type=int, default=None, help="maximum number of headless frames")
+    parser.add_argument("--map", choices=sorted(MAP_CONFIGS), default="scan1_livingroom", help="map to generate the walls from")
+    parser.add_argument("--rect-map", help="image whose black pixels become rectangle obstacles (overrides --map)")
+    parser.add_argument("--ros-map", help="map_server YAML whose occupied cells become the walls (overrides --map; the grid backend scans its cells directly)")
+    parser.add_argument("--tiled-map", help="large binary PGM map (memory mapped) processed tile by tile around the user at its native resolution (overrides --map)")
+    parser.add_argument("--fps", type=int, default=60, help="display frame rate (headless: simulated frames per second)")
+    parser.add_argument("--sensor-rate", type=float, default=30, help="scan/plan rate of the sensor thread in Hz (0 scans every frame; headless runs always do)")
+    parser.add_argument("--lidar", choices=["shapely", "numpy", "sphere", "grid"], default=None, help="LiDAR backend")
+    parser.add_argument("--incremental", action="store_true", help="incremental numpy scans that re-test last scan's hit edges first")
+    parser.add_argument("--grid", help="occupancy image (dark = occupied, one pixel per cell) for the grid backend instead of rasterizing the walls")
+    parser.add_argument("--grid-cell", type=float, default=2.0, help="world pixels per --grid image pixel")
+    parser.add_argument("--scans", help="recorded LaserScan frames (JSON lines) to use instead of the simulated LiDAR")
+    parser.add_argument("--listen", type=int, metavar="PORT", help="use live frames sent to this local UDP port (see scan_source.py) instead of the simulated LiDAR")
+    parser.add_argument("--record", help="log every frame to this session directory")
+    parser.add_argument("--replay", help="replay a recorded session directory through the planner (and the renderer unless --headless)")
+    parser.add_argument("--profile", nargs="?", const="", metavar="PATH", help="time every stage and print percentiles at exit; with a .csv or .json PATH also dump them there periodically (F3 toggles the overlay either way)")
+    parser.add_argument("--profile-interval", type=float, default=5.0, help="seconds between --profile dumps")
+    parser.add_argument("--assist", type=int, choices=[0, 1, 2], default=None, help="assistance button index (0 none, 1 some, 2 stronger)")
+    args = parser.parse_args()
+
+    if args.headless and args.script is None and args.frames is None and args.replay is None and args.scans is None:
+        parser.error("--headless needs --script or --frames to know when to stop")
+
+    input_script = user.load_input_script(args.script) if args.script else None
+    grid = occupancy_grid.Occupancy_Grid.from_image(args.grid, cell_size=args.grid_cell) if args.grid else None
+    lidar_backend = "grid" if grid is not None and args.lidar is None else args.lidar
+    # A replay draws the map it was recorded on
+    map_name = args.map
+    if args.replay:
+        import session_log
+        map_name = session_log.read_meta(args.replay).get("map") or args.map
+
+    # Recorded scans play back at their own pace in a window and one frame per step headless
+    scans = None
+    if args.scans:
+        scans = scan_source.Recorded_Scan_Source(scan_source.read_scan_file(args.scans), realtime=not args.headless)
+    elif args.listen:
+        scans = scan_source.Socket_Scan_Source(port=args.listen)
+
+    sim = Simulation(headless=args.headless, input_script=input_script, map_name=map_name, rect_map_path=args.rect_map, ros_map_path=args.ros_map, tiled_map_path=args.tiled_map, grid=grid, lidar_backend=lidar_backend, lidar_incremental=args.incremental, scans=scans)
+
+    sim.FPS = args.fps
+    sim.SENSOR_RATE = args.sensor_rate or None
+
+    if args.assist is not None:
+        sim.ctrl_index = args.assist
+        sim.control_strength = sim.buttons[args.assist]["strength"]
+
+    if args.record:
+        sim.start_recording(args.record)
+
+    if args.profile is not None:
+        sim.profiler = profiler.Frame_Profiler(enabled=True, dump_path=args.profile or None, dump_interval=args.profile_interval)
+
+    # The recording is closed (and so flushed) even when the run dies part way
+    try:
+        if args.replay:
+            stats = sim.run_replay(args.replay)
+            plan_ms = np.asarray(stats["plan_times"]) * 1000
+            if len(plan_ms):
+                print(f"Replayed {stats['frames']} frames: planner mean {plan_ms.mean():.3f} ms, p95 {np.percentile(plan_ms, 95):.3f} ms, "
+                      f"max curve difference from the recording {stats['max_curve_diff']:.3g} px")
+        elif args.headless:
+            stats = sim.run_headless(args.frames)
+            print(f"Simulated {stats['frames']} frames ({stats['sim_seconds']:.1f} s) in {stats['wall_seconds']:.2f} s "
+                  f"({stats['sim_seconds'] / max(stats['wall_seconds'], 1e-9):.1f}x real time), final position ({stats['final_pos'][0]:.1f}, {stats['final_pos'][1]:.1f})")
+        else:
+            sim.run()
+    finally:
+        sim.stop_recording()
+        sim.scan_source.close()
+        if sim.world is not None:
+            sim.world.close()
+
+    if sim.profiler.enabled:
+        if sim.profiler.dump_path is not None:
+            sim.profiler.dump()
+        print("\n".join(sim.profiler.format_lines()))
+    pygame.quit()
@@ -0,0 +1,111 @@
+import os
+import hashlib
+import numpy as np
+
+# Bump whenever the polygon pipeline changes so old cache entries stop matching
+CACHE_VERSION = 1
+
+def file_hash(path):
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+# Key on the image content (not its path or mtime) plus every parameter that affects the polygons
+def cache_key(map_path, params):
+
+    sha = hashlib.sha256()
+    sha.update(f"v{CACHE_VERSION}".encode())
+    sha.update(file_hash(map_path).encode())
+    for name in sorted(params):
+        sha.update(f"{name}={params[name]!r};".encode())
+
+    return sha.hexdigest()
+
+def cache_path(cache_dir, map_path, key):
+
+    name = os.path.splitext(os.path.basename(map_path))[0]
+    return os.path.join(cache_dir, f"{name}-{key[:16]}.npz")
+
+'''
+Polygons are stored as one (V, 2) float64 vertex array plus per polygon offsets
+Polygon i is coords[offsets[i]:offsets[i + 1]]
+'''
+def save_polys(path, polys):
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    counts = [len(poly) for poly in polys]
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    coords = np.array([pt for poly in polys for pt in poly], dtype=np.float64).reshape(-1, 2)
+
+    # Write then rename so an interrupted run never leaves a truncated entry behind
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, coords=coords, offsets=offsets)
+    os.replace(tmp_path, path)
+
+def load_polys(path):
+
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        with np.load(path) as data:
+            coords = data['coords']
+            offsets = data['offsets']
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Warning: Ignoring unreadable map cache {path}: {e}")
+        return None
+
+    return [[(x, y) for (x, y) in coords[offsets[i]:offsets[i + 1]].tolist()] for i in range(len(offsets) - 1)]
+
+# Distance fields live in the same file as the polygons they were computed from, one pair of arrays per cell size
+def field_keys(cell_size):
+
+    name = f"{float(cell_size)!r}".replace(".", "_")
+    return f"field_{name}", f"field_origin_{name}"
+
+'''
+Adds the distance field of one cell size to an existing entry (fields of other cell sizes are kept)
+Saving the polygons again rewrites the file without any fields, since they belong to the old polygons
+'''
+def save_distance_field(path, cell_size, field, origin):
+
+    if not os.path.isfile(path):
+        return
+
+    try:
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+    except (OSError, ValueError) as e:
+        print(f"Warning: Not caching distance field in unreadable map cache {path}: {e}")
+        return
+
+    field_key, origin_key = field_keys(cell_size)
+    arrays[field_key] = np.asarray(field, dtype=np.float32)
+    arrays[origin_key] = np.asarray(origin, dtype=np.float64)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, path)
+
+# (field, origin) of the given cell size, or None when the entry doesn't have it
+def load_distance_field(path, cell_size):
+
+    if not os.path.isfile(path):
+        return None
+
+    field_key, origin_key = field_keys(cell_size)
+    try:
+        with np.load(path) as data:
+            if field_key not in data.files or origin_key not in data.files:
+                return None
+            return data[field_key], data[origin_key]
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable map cache {path}: {e}")
+        return None
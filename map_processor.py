@@ -1,9 +1,12 @@
+import numpy as np
 import pygame
 from obstacle import Obst_Rect as Rect
 
 def load_map(map_path):
     try:
-        map_image = pygame.image.load(map_path).convert_alpha()
+        map_image = pygame.image.load(map_path)
+        # convert_alpha needs a display; headless runs use the loaded surface as is
+        map_image = map_image.convert_alpha() if pygame.display.get_surface() is not None else map_image
         print(f"Loaded map: {map_path}")
     except pygame.error as e:
         print(f"Error loading map: {e}")
@@ -15,39 +18,59 @@ def load_map(map_path):
     map_surface = pygame.Surface((width, height), pygame.SRCALPHA)
     map_surface.blit(map_image, (0, 0))
 
-    return extract_obstacles_get_at(map_surface, width, height)
+    return extract_obstacles(map_surface)
 
-def extract_obstacles_get_at(map_surface, width, height):
-    obstacles = []
-    visited = set()
+# Boolean mask of exactly black, opaque pixels indexed [x, y] (same layout as Surface.get_at)
+def black_mask(map_surface):
 
-    for x in range(width):
-        for y in range(height):
-            pixel_color = map_surface.get_at((x, y))
-            # Check if it's black enough (threshold) or exactly black:
-            if pixel_color == (0, 0, 0, 255) and (x, y) not in visited:
-                rect_w, rect_h = find_rect_size_get_at(map_surface, width, height, x, y, visited)
-                obstacles.append(Rect((x, y), (rect_w, rect_h)))
+    rgb = pygame.surfarray.pixels3d(map_surface)
+    alpha = pygame.surfarray.pixels_alpha(map_surface)
+    mask = (rgb == 0).all(axis=2) & (alpha == 255)
 
-    return obstacles
+    # Release the pixel views so the surface is unlocked again
+    del rgb, alpha
+
+    return mask
+
+# For every pixel, how many consecutive True pixels start there along the axis (0 where the mask is False)
+def run_lengths(mask, axis):
+
+    lines = np.moveaxis(mask, axis, -1)
+    length = lines.shape[-1]
+    idx = np.arange(length)
 
-def find_rect_size_get_at(map_surface, width, height, start_x, start_y, visited):
-    rect_width = 0
-    rect_height = 0
+    # Index of the next False pixel at or after each position (length if none)
+    false_pos = np.where(lines, length, idx)
+    next_false = np.minimum.accumulate(false_pos[..., ::-1], axis=-1)[..., ::-1]
 
-    # Expand width
-    while (start_x + rect_width < width and 
-           map_surface.get_at((start_x + rect_width, start_y)) == (0, 0, 0, 255)):
-        rect_width += 1
+    return np.moveaxis(next_false - idx, -1, axis)
 
-    # Expand height
-    while (start_y + rect_height < height and 
-           map_surface.get_at((start_x, start_y + rect_height)) == (0, 0, 0, 255)):
-        rect_height += 1
+'''
+Greedy rectangle decomposition of the black pixels, scanning columns left to right and each column top to bottom
+Each unvisited black pixel starts a rectangle as wide as the black run to its right and as tall as the black run below it
+Run lengths come from whole-image array operations, so the only Python loop is over rectangle seeds
+'''
+def extract_obstacles(map_surface):
+    mask = black_mask(map_surface)
+    right_run = run_lengths(mask, 0)
+    down_run = run_lengths(mask, 1)
 
-    # Mark pixels visited
-    for i in range(rect_width):
-        for j in range(rect_height):
-            visited.add((start_x + i, start_y + j))
+    visited = np.zeros(mask.shape, dtype=bool)
+    flat_visited = visited.ravel() # View, so rectangle writes below show up here
+    height = mask.shape[1]
+    obstacles = []
+
+    # Row-major order of an [x, y] array is column by column, top to bottom (same as the original scan)
+    for flat_idx in np.flatnonzero(mask):
+        if flat_visited[flat_idx]:
+            continue
+
+        x, y = divmod(int(flat_idx), height)
+        rect_w = int(right_run[x, y])
+        rect_h = int(down_run[x, y])
 
-    return rect_width, rect_height
+        # Mark pixels visited
+        visited[x:x + rect_w, y:y + rect_h] = True
+        obstacles.append(Rect((x, y), (rect_w, rect_h)))
+
+    return obstacles
@@ -1,14 +1,43 @@
-import pygame
+import os
+import time
 import math
+import functools
 import numpy as np
 
-import cv2
 from shapely.geometry import Polygon
-from shapely.ops import cascaded_union
+from shapely.ops import unary_union
+
+import distance_field
+import occupancy_grid
+import map_cache
+
+'''
+OpenCV is imported by the methods that process images, so loading cached polygons never pays for it
+'''
+
+# For each 8-neighbour code, whether Zhang-Suen thinning deletes the centre pixel in sub-iteration 1 and 2 (built on first use)
+@functools.lru_cache(maxsize=None)
+def zhang_suen_luts():
+
+    luts = (np.zeros(256, bool), np.zeros(256, bool))
+    for code in range(256):
+        p = [(code >> k) & 1 for k in range(8)] # P2..P9
+        neighbours = sum(p)
+        transitions = sum(p[k] == 0 and p[(k + 1) % 8] == 1 for k in range(8))
+
+        if 2 <= neighbours <= 6 and transitions == 1:
+            p2, p4, p6, p8 = p[0], p[2], p[4], p[6]
+            luts[0][code] = p2 * p4 * p6 == 0 and p4 * p6 * p8 == 0
+            luts[1][code] = p2 * p4 * p8 == 0 and p2 * p6 * p8 == 0
+
+    return luts
+
+# Shapely buffer join styles by name
+BUFFER_JOIN_STYLES = {"round": 1, "mitre": 2, "bevel": 3}
 
 class Sim_Map_Generator:
 
-    def __init__(self, map, scale=1.0, merge_thresh=5, area_thresh=200, thickness=8, screen_width=1280, screen_height=720, close_kernel_size=(5, 5), close_iter=3, h_thresh=40, min_line_len=20, max_line_gap=15):
+    def __init__(self, map, scale=1.0, merge_thresh=5, area_thresh=200, thickness=8, screen_width=1280, screen_height=720, close_kernel_size=(5, 5), close_iter=3, h_thresh=40, min_line_len=20, max_line_gap=15, cache_dir=".map_cache", skel_mode="morph", join_style="round", simplify_tol=0):
         
         self.map = map
         self.scale = scale
@@ -26,9 +55,49 @@ class Sim_Map_Generator:
         self.hough_thresh = h_thresh
         self.min_line_len = min_line_len
         self.max_line_gap = max_line_gap
+
+        self.join_style = join_style # Buffer joins when merging: "round" adds arc vertices, "mitre"/"bevel" keep corners sharp
+        self.simplify_tol = simplify_tol # Max distance (pixels) simplified outlines may deviate; 0 disables simplification
+        self.poly_stats = {} # Counts before and after simplification on the last uncached run
+
+        self.skel_mode = skel_mode # "morph", "morph_prealloc", "thinning" or "thinning_cv2" (see gen_skeleton)
+        self.skel_stats = {} # Mode, iteration count and time of the last skeleton
+
+        self.cache_dir = cache_dir # Directory for cached polygons; None disables the on-disk cache
+
+        # Results cached with the generated map
+        self.stage_times = {} # Seconds spent per pipeline stage on the last uncached run
+        self.polys = None
+        self.cache_file = None # On-disk cache entry of the current polygons (distance fields are stored alongside)
+        self.distance_fields = {} # cell_size -> Distance_Field
+        self.occupancy_grids = {} # cell_size -> Occupancy_Grid
     
     # Creates a skeleton for the walls to determine seperation points for polygon generation
-    def gen_skeleton(self, preproc_map_cv2_img):
+    def gen_skeleton(self, preproc_map_cv2_img, mode=None):
+
+        if mode is None:
+            mode = self.skel_mode
+
+        start = time.perf_counter()
+        if mode == "morph":
+            skeleton, iterations = self.morph_skeleton(preproc_map_cv2_img)
+        elif mode == "morph_prealloc":
+            skeleton, iterations = self.morph_skeleton_prealloc(preproc_map_cv2_img)
+        elif mode == "thinning":
+            skeleton, iterations = self.thinning_skeleton(preproc_map_cv2_img)
+        elif mode == "thinning_cv2":
+            skeleton, iterations = self.thinning_skeleton_cv2(preproc_map_cv2_img)
+        else:
+            raise ValueError(f"Unknown skeleton mode: {mode}")
+
+        self.skel_stats = {"mode": mode, "iterations": iterations, "time": time.perf_counter() - start}
+
+        return skeleton
+
+    # Morphological skeleton: repeated opening, keeping what each opening removes
+    def morph_skeleton(self, preproc_map_cv2_img):
+
+        import cv2
 
         # cv2 saves images as numpy
         skeleton = np.zeros(preproc_map_cv2_img.shape, np.uint8)
@@ -41,6 +110,7 @@ class Sim_Map_Generator:
         # struct_elem = np.ones((3,3))
         # struct_elem = np.array([[1, 0, 1], [0, 1, 0], [1, 0, 1]], dtype=np.uint8)
         temp = preproc_map_cv2_img.copy()
+        iterations = 0
 
         # Erosion and dilation
         while cv2.countNonZero(temp) != 0:
@@ -50,8 +120,66 @@ class Sim_Map_Generator:
             cmp_img = cv2.subtract(temp, dilated_img) # Subtract iterative image with opened image; Captures the edges of each shape
             skeleton = cv2.bitwise_or(skeleton, cmp_img) # Saving the progress of the iterations (layering progress)
             temp = eroded_img.copy()
+            iterations += 1
         
-        return skeleton
+        return skeleton, iterations
+
+    # Same skeleton as morph_skeleton, but every pass writes into three buffers allocated up front
+    def morph_skeleton_prealloc(self, preproc_map_cv2_img):
+
+        import cv2
+
+        struct_elem = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+        skeleton = np.zeros(preproc_map_cv2_img.shape, np.uint8)
+        temp = preproc_map_cv2_img.copy()
+        eroded_img = np.empty_like(temp)
+        opened_img = np.empty_like(temp)
+        iterations = 0
+
+        while cv2.countNonZero(temp) != 0:
+            cv2.erode(temp, struct_elem, dst=eroded_img)
+            cv2.dilate(eroded_img, struct_elem, dst=opened_img)
+            cv2.subtract(temp, opened_img, dst=opened_img)
+            cv2.bitwise_or(skeleton, opened_img, dst=skeleton)
+            temp, eroded_img = eroded_img, temp # Swap buffers instead of copying the eroded image
+            iterations += 1
+
+        return skeleton, iterations
+
+    '''
+    Zhang-Suen thinning: peels one pixel layer per pass while keeping strokes connected, giving a one pixel wide
+    skeleton without the spurs of the morphological one
+    '''
+    def thinning_skeleton(self, preproc_map_cv2_img):
+
+        binary = (preproc_map_cv2_img > 0).astype(np.uint8)
+        img = np.pad(binary, 1)
+        flat = img.ravel()
+        width = img.shape[1]
+        # Flat offsets of the neighbours clockwise from north: P2 (N), P3 (NE), P4 (E), ... P9 (NW)
+        offsets = (-width, -width + 1, 1, width + 1, width, width - 1, -1, -width - 1)
+
+        # Only foreground pixels are ever visited, and deleted ones drop out of the list
+        fg_ids = np.flatnonzero(flat)
+        iterations = 0
+        changed = True
+
+        while changed:
+            changed = False
+            for lut in zhang_suen_luts():
+                code = np.zeros(len(fg_ids), np.uint8)
+                for k, offset in enumerate(offsets):
+                    code |= flat[fg_ids + offset] << k
+
+                remove = lut[code]
+                if remove.any():
+                    flat[fg_ids[remove]] = 0
+                    fg_ids = fg_ids[~remove]
+                    changed = True
+
+            iterations += 1
+
+        return img[1:-1, 1:-1] * 255, iterations
     
     def merge_polys(self, poly_list):
     
@@ -59,12 +187,12 @@ class Sim_Map_Generator:
         for poly in poly_list:
 
             if len(poly) >= 3: # Check number of vertices (min 3 for valid polygon)
-                polys.append(Polygon(poly).buffer(self.merge_thresh)) # Buffer extends shapes so that close shapes overlap for merging
+                polys.append(Polygon(poly).buffer(self.merge_thresh, join_style=BUFFER_JOIN_STYLES[self.join_style])) # Buffer extends shapes so that close shapes overlap for merging
 
         if not polys:
             return []
 
-        merged = cascaded_union(polys) # Performs union on the buffered shapes; Merges polygons that overlapping
+        merged = unary_union(polys) # Performs union on the buffered shapes; Merges polygons that overlapping
         merged_polys = []
 
         if merged.geom_type == 'Polygon':
@@ -78,6 +206,46 @@ class Sim_Map_Generator:
                     continue
 
         return merged_polys
+
+    # OpenCV contrib's Zhang-Suen thinning (needs opencv-contrib-python); it doesn't report passes, so iterations is None
+    def thinning_skeleton_cv2(self, preproc_map_cv2_img):
+
+        import cv2
+
+        if not hasattr(cv2, 'ximgproc'):
+            raise ValueError("Skeleton mode thinning_cv2 needs cv2.ximgproc (opencv-contrib-python)")
+
+        binary = (preproc_map_cv2_img > 0).astype(np.uint8)
+
+        return cv2.ximgproc.thinning(binary * 255, thinningType=cv2.ximgproc.THINNING_ZHANGSUEN), None
+
+    # Reduce vertex count while keeping every vertex within tolerance of the original outline
+    def simplify_polys(self, poly_coords, tolerance=None):
+
+        if tolerance is None:
+            tolerance = self.simplify_tol
+
+        if tolerance <= 0:
+            return poly_coords
+
+        simplified_polys = []
+        for coords in poly_coords:
+            simplified = Polygon(coords).simplify(tolerance, preserve_topology=True)
+
+            # Keep the original outline if simplification collapsed it
+            if simplified.geom_type == 'Polygon' and not simplified.is_empty:
+                simplified_polys.append(list(simplified.exterior.coords))
+            else:
+                simplified_polys.append(coords)
+
+        return simplified_polys
+
+    # Polygon and distinct vertex counts (a ring's closing point repeats its first; a ring has as many edges as vertices)
+    # Every tool reports counts through this so they agree on the same map
+    def poly_counts(self, poly_coords):
+
+        vertices = sum(len(coords) - 1 if len(coords) > 1 and tuple(coords[0]) == tuple(coords[-1]) else len(coords) for coords in poly_coords)
+        return {"polygons": len(poly_coords), "vertices": vertices}
     
     # Filter out polygons based on area threshold
     def filter_polys(self, poly_coords, area_thresh=None):
@@ -122,17 +290,25 @@ class Sim_Map_Generator:
 
         return [pt1, pt2, pt3, pt4]
     
-    def proc_img(self, img_path):
+    # Read the image and fit it to the screen
+    def load_img(self, img_path):
+
+        import cv2
 
         img = cv2.imread(img_path)
 
         if img is None:
             print("Warning: Couldn't load image", img_path)
-            return []
+            return None
+
+        return cv2.resize(img, (self.screen_width, self.screen_height))
+
+    # Binary wall mask: threshold then close small gaps (img is BGR or already grayscale)
+    def preproc_img(self, img):
 
-        img = cv2.resize(img, (self.screen_width, self.screen_height))
+        import cv2
 
-        gray_scale = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray_scale = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else np.ascontiguousarray(img)
         gray_scale = cv2.GaussianBlur(gray_scale, (3, 3), 0) # Blur reduces noise
 
         # https://docs.opencv.org/4.x/d7/d1b/group__imgproc__misc.html#ga72b913f352e4a1b1b397736707afcde3
@@ -144,8 +320,13 @@ class Sim_Map_Generator:
         kernel = np.ones(self.close_kernel_size, np.uint8)
         for _ in range(self.close_iter):
             proc_img = cv2.morphologyEx(proc_img, cv2.MORPH_CLOSE, kernel) # Closing (Dilation then erosion)
-        
-        skel_img = self.gen_skeleton(proc_img)
+
+        return proc_img
+
+    # Wall line segments of a skeleton image
+    def detect_lines(self, skel_img):
+
+        import cv2
 
         # https://www.geeksforgeeks.org/python-opencv-canny-function/
         # Use Canny for edge detection
@@ -161,6 +342,37 @@ class Sim_Map_Generator:
                 line_segs.append((x1, y1, x2, y2))
 
         return line_segs
+
+    def proc_img(self, img_path):
+
+        # Time spent in each stage of the last run (seconds)
+        self.stage_times = {}
+
+        start = time.perf_counter()
+        img = self.load_img(img_path)
+        self.stage_times["load"] = time.perf_counter() - start
+
+        if img is None:
+            return []
+
+        return self.proc_array(img)
+
+    # Wall line segments of an image already in memory (e.g. one tile of a larger map)
+    def proc_array(self, img):
+
+        start = time.perf_counter()
+        proc_img = self.preproc_img(img)
+        self.stage_times["preproc"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        skel_img = self.gen_skeleton(proc_img)
+        self.stage_times["skeleton"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        line_segs = self.detect_lines(skel_img)
+        self.stage_times["lines"] = time.perf_counter() - start
+
+        return line_segs
     
     def scale_poly(self, poly, scale=None):
 
@@ -171,31 +383,113 @@ class Sim_Map_Generator:
 
         return scaled_poly
     
+    # Every setting that changes the generated polygons (used as the on-disk cache key)
+    def cache_params(self):
+
+        return {
+            "scale": self.scale, "merge_thresh": self.merge_thresh, "area_thresh": self.area_thresh, "thickness": self.thickness,
+            "screen_width": self.screen_width, "screen_height": self.screen_height,
+            "close_kernel_size": tuple(self.close_kernel_size), "close_iter": self.close_iter,
+            "h_thresh": self.hough_thresh, "min_line_len": self.min_line_len, "max_line_gap": self.max_line_gap,
+            # Both morphological modes give the same skeleton, so they share cache entries
+            "skel_mode": "morph" if self.skel_mode in ("morph", "morph_prealloc") else self.skel_mode,
+            "join_style": self.join_style, "simplify_tol": self.simplify_tol,
+        }
+
     def gen_map_polys(self):
 
+        # Reuse polygons from a previous run on the same image and settings
+        cache_file = None
+        self.cache_file = None
+        if self.cache_dir is not None and os.path.isfile(self.map):
+            cache_file = map_cache.cache_path(self.cache_dir, self.map, map_cache.cache_key(self.map, self.cache_params()))
+            cached_polys = map_cache.load_polys(cache_file)
+
+            if cached_polys is not None:
+                self.polys = cached_polys
+                self.cache_file = cache_file
+                self.distance_fields = {}
+                self.occupancy_grids = {}
+                return self.polys
+
         line_segs = self.proc_img(self.map)
+        self.polys = self.lines_to_polys(line_segs)
+        self.distance_fields = {} # Fields and grids of a previous map are stale
+        self.occupancy_grids = {}
+
+        if cache_file is not None and line_segs:
+            map_cache.save_polys(cache_file, self.polys)
+            self.cache_file = cache_file
 
+        return self.polys
+
+    # Thicken, merge, simplify, filter and scale detected wall lines into the final polygons
+    def lines_to_polys(self, line_segs):
+
+        start = time.perf_counter()
         wall_polys = []
         for (x1, y1, x2, y2) in line_segs:
             poly = self.thicken_poly(x1, y1, x2, y2)
 
             if poly is not None:
                 wall_polys.append(poly)
+        self.stage_times["thicken"] = time.perf_counter() - start
 
+        start = time.perf_counter()
         merged_polys = self.merge_polys(wall_polys)
-        filtered_polys = self.filter_polys(merged_polys)
+        self.stage_times["merge"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        simplified_polys = self.simplify_polys(merged_polys)
+        self.stage_times["simplify"] = time.perf_counter() - start
+        self.poly_stats = {"merged": self.poly_counts(merged_polys), "simplified": self.poly_counts(simplified_polys)}
 
+        start = time.perf_counter()
+        filtered_polys = self.filter_polys(simplified_polys)
+        self.stage_times["filter"] = time.perf_counter() - start
 
         if self.scale != 1.0:
-            scaled_polys = [self.scale_poly(poly) for poly in filtered_polys]
-            return scaled_polys
+            return [self.scale_poly(poly) for poly in filtered_polys]
         else:
             return filtered_polys
-        # return filtered_polys
+
+    # Euclidean distance field of the generated walls, computed once per map and cell size and cached with the polygons
+    def gen_distance_field(self, cell_size=2.0):
+
+        if self.polys is None:
+            self.gen_map_polys()
+
+        if cell_size in self.distance_fields:
+            return self.distance_fields[cell_size]
+
+        cached = map_cache.load_distance_field(self.cache_file, cell_size) if self.cache_file is not None else None
+        if cached is not None:
+            self.distance_fields[cell_size] = distance_field.Distance_Field.from_field(cached[0], cached[1], cell_size)
+        else:
+            field = distance_field.Distance_Field(self.polys, cell_size=cell_size)
+            self.distance_fields[cell_size] = field
+
+            if self.cache_file is not None:
+                map_cache.save_distance_field(self.cache_file, cell_size, field.field, field.origin)
+
+        return self.distance_fields[cell_size]
+
+    # Rasterized occupancy grid of the generated walls, computed once per map and cell size
+    def gen_occupancy_grid(self, cell_size=2.0):
+
+        if self.polys is None:
+            self.gen_map_polys()
+
+        if cell_size not in self.occupancy_grids:
+            self.occupancy_grids[cell_size] = occupancy_grid.Occupancy_Grid.from_polys(self.polys, cell_size=cell_size)
+
+        return self.occupancy_grids[cell_size]
 
 # For testing the class directly:
 if __name__ == '__main__':
 
+    import pygame
+
     map_gen = Sim_Map_Generator("maps/scan1_livingroom.png", scale=2.0)
     polygons = map_gen.gen_map_polys()
     print("Generated wall polygons:", len(polygons))
@@ -1,3 +1,4 @@
+import numpy as np
 import pygame
 
 # Simulated Obstacle
@@ -16,6 +17,11 @@ class Obst_Rect(Obstacle):
 
         super().__init__(pos, dim)
 
+        # Outline so rectangles work anywhere polygon obstacles do (sensor, spatial index, renderer)
+        x, y = pos
+        w, h = dim
+        self.poly = [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+
     def render(self, screen, user_pos, is_vis=False):
 
         relative_pos = (self.pos[0] - user_pos[0], self.pos[1] - user_pos[1])
@@ -25,4 +31,163 @@ class Obst_Rect(Obstacle):
         else:
             render_col = self.BLACK
 
-        pygame.draw.rect(screen, render_col, (relative_pos[0], relative_pos[1], self.dim[0], self.dim[1]))
\ No newline at end of file
+        pygame.draw.rect(screen, render_col, (relative_pos[0], relative_pos[1], self.dim[0], self.dim[1]))
+
+
+# Lightweight handle on one polygon of an Obst_Set (no copies; everything reads the set's arrays)
+class Obst_View:
+
+    __slots__ = ("obst_set", "idx")
+
+    def __init__(self, obst_set, idx):
+
+        self.obst_set = obst_set
+        self.idx = idx
+
+    # (k, 2) vertices of the open ring
+    @property
+    def poly(self):
+
+        offsets = self.obst_set.offsets
+        return self.obst_set.coords[offsets[self.idx]:offsets[self.idx + 1]]
+
+    @property
+    def shapely_poly(self):
+
+        return self.obst_set.shapely_polys()[self.idx]
+
+    # (min_x, min_y, max_x, max_y)
+    @property
+    def bounds(self):
+
+        return tuple(self.obst_set.bounds[self.idx])
+
+    # So a view can go wherever a vertex array can (np.asarray(view), cv2, ...)
+    def __array__(self, dtype=None, copy=None):
+
+        return np.asarray(self.poly, dtype=dtype)
+
+'''
+Every wall polygon of a map in a few flat arrays instead of one object each
+coords => (V, 2) vertices of all polygons as open rings, polygon i is coords[offsets[i]:offsets[i + 1]]
+bounds => (N, 4) bounding box of every polygon (min_x, min_y, max_x, max_y)
+edge_starts, edge_vecs => (V, 2) edge k runs from coords[k] to the next vertex of its ring (the last one back to the first)
+edge_obj_ids => (V,) polygon every edge belongs to
+Indexing or iterating gives Obst_View handles, so code written for lists of obstacles keeps working
+'''
+class Obst_Set:
+
+    def __init__(self, coords, offsets):
+
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.counts = np.diff(self.offsets)
+
+        if len(self.counts) and self.counts.min() < 1:
+            raise ValueError("Obst_Set polygons need at least one vertex")
+
+        self.edge_obj_ids = np.repeat(np.arange(len(self.counts)), self.counts)
+
+        # Next vertex of every vertex within its own ring
+        next_ids = np.arange(1, len(self.coords) + 1)
+        next_ids[self.offsets[1:] - 1] = self.offsets[:-1]
+        self.edge_starts = self.coords
+        self.edge_vecs = self.coords[next_ids] - self.coords if len(self.coords) else np.empty((0, 2))
+
+        if len(self.counts):
+            starts = self.offsets[:-1]
+            self.bounds = np.column_stack((np.minimum.reduceat(self.coords, starts), np.maximum.reduceat(self.coords, starts)))
+        else:
+            self.bounds = np.empty((0, 4))
+
+        self.shapes = None # Shapely polygons, built on first use
+        self.parts = None # Sets this one was concatenated from, whose shapely polygons are reused
+
+    # Any sequence of vertex sequences (lists of tuples, shapely coords, arrays); closed rings are stored open
+    @classmethod
+    def from_polys(cls, polys):
+
+        rings = []
+        for idx, poly in enumerate(polys):
+            ring = np.asarray(poly, dtype=float).reshape(-1, 2)
+
+            if len(ring) > 1 and np.array_equal(ring[0], ring[-1]):
+                ring = ring[:-1]
+
+            # Dropping it instead would shift the ids of every later obstacle
+            if len(ring) < 3:
+                raise ValueError(f"Obstacle {idx} has {len(ring)} vertices, a wall needs at least 3")
+
+            rings.append(ring)
+
+        offsets = np.concatenate(([0], np.cumsum([len(ring) for ring in rings], dtype=np.int64)))
+        coords = np.concatenate(rings) if rings else np.empty((0, 2))
+
+        return cls(coords, offsets)
+
+    # One set holding the polygons of several, in order
+    @classmethod
+    def concat(cls, obst_sets):
+
+        obst_sets = [obst_set for obst_set in obst_sets if len(obst_set)]
+        if not obst_sets:
+            return cls(np.empty((0, 2)), [0])
+
+        coords = np.concatenate([obst_set.coords for obst_set in obst_sets])
+        counts = np.concatenate([obst_set.counts for obst_set in obst_sets])
+        combined = cls(coords, np.concatenate(([0], np.cumsum(counts))))
+        combined.parts = obst_sets
+
+        return combined
+
+    def __len__(self):
+
+        return len(self.counts)
+
+    def __getitem__(self, idx):
+
+        if not -len(self) <= idx < len(self):
+            raise IndexError(f"Obstacle {idx} out of range for {len(self)} obstacles")
+
+        return Obst_View(self, idx % len(self))
+
+    def __iter__(self):
+
+        for idx in range(len(self)):
+            yield Obst_View(self, idx)
+
+    # Vertex arrays of every polygon (views into coords)
+    def polys(self):
+
+        return [self.coords[start:end] for start, end in zip(self.offsets[:-1], self.offsets[1:])]
+
+    def shapely_polys(self):
+
+        if self.shapes is None and self.parts is not None:
+            self.shapes = [shape for part in self.parts for shape in part.shapely_polys()]
+        elif self.shapes is None:
+            from shapely.geometry import Polygon
+            self.shapes = [Polygon(poly) for poly in self.polys()]
+
+        return self.shapes
+
+    # Edge (= vertex) ids of the given polygons, in order
+    def edge_ids(self, obj_ids):
+
+        obj_ids = np.asarray(obj_ids, dtype=int)
+        counts = self.counts[obj_ids]
+        if counts.sum() == 0:
+            return np.empty(0, dtype=int)
+
+        # Each polygon's run starts at its offset; positions inside a run count up from there
+        run_starts = np.repeat(self.offsets[obj_ids] - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+
+        return run_starts + np.arange(counts.sum())
+
+# Obstacles as an Obst_Set, converting lists of objects with a .poly outline (e.g. Obst_Rect)
+def as_obst_set(objs):
+
+    if isinstance(objs, Obst_Set):
+        return objs
+
+    return Obst_Set.from_polys([obj.poly for obj in objs])
@@ -0,0 +1,128 @@
+import numpy as np
+
+# Sub-pixel precision bits used when rasterizing polygons with cv2.fillPoly
+RASTER_SHIFT = 4
+
+# Grid cell (row, col) covers world x in [origin_x + col * cell_size, origin_x + (col + 1) * cell_size) and likewise for y
+def rasterize_polys(polys, origin, cell_size, shape):
+
+    import cv2
+
+    occupied = np.zeros(shape, np.uint8)
+    scale = 1 << RASTER_SHIFT
+
+    for poly in polys:
+        # Cell centres sit at half cell offsets from the origin
+        cell_pts = (np.asarray(poly, dtype=float) - origin) / cell_size - 0.5
+        pts = np.round(cell_pts * scale).astype(np.int32)
+        cv2.fillPoly(occupied, [pts], 255, lineType=cv2.LINE_8, shift=RASTER_SHIFT)
+
+    return occupied
+
+'''
+Boolean occupancy grid of the walls (row 0 is the top, i.e. the smallest world y, like the screen)
+Ray marching it costs one lookup per traversed cell, so a scan is bounded by the LiDAR range in cells
+no matter how many polygons or vertices the map has
+'''
+class Occupancy_Grid:
+
+    def __init__(self, occupied, cell_size=2.0, origin=(0, 0)):
+
+        self.occupied = np.asarray(occupied, dtype=bool) # (rows, cols)
+        self.cell_size = cell_size # World pixels per grid cell
+        self.origin = np.asarray(origin, dtype=float) # World position of the grid's top left corner
+        self.shape = self.occupied.shape
+
+    # Rasterizes wall polygons (e.g. from Sim_Map_Generator.gen_map_polys)
+    @classmethod
+    def from_polys(cls, polys, cell_size=2.0, padding=None):
+
+        padding = cell_size if padding is None else padding
+        coords = np.concatenate([np.asarray(poly, dtype=float) for poly in polys]) if polys else np.zeros((1, 2))
+        origin = coords.min(axis=0) - padding
+        extent = coords.max(axis=0) + padding - origin
+        shape = (int(np.ceil(extent[1] / cell_size)) + 1, int(np.ceil(extent[0] / cell_size)) + 1) # (rows, cols)
+
+        return cls(rasterize_polys(polys, origin, cell_size, shape) > 0, cell_size, origin)
+
+    '''
+    Occupancy probabilities as published by a mapper (0 to 100, -1 unknown, like nav_msgs/OccupancyGrid data reshaped
+    to (height, width)). Cells at or above occupied_thresh count as walls; unknown cells are free unless unknown_occupied
+    '''
+    @classmethod
+    def from_probabilities(cls, probs, cell_size=2.0, origin=(0, 0), occupied_thresh=0.65, unknown_occupied=False):
+
+        probs = np.asarray(probs)
+        unknown = probs < 0
+        occupied = (probs >= occupied_thresh * 100) & ~unknown
+
+        if unknown_occupied:
+            occupied |= unknown
+
+        return cls(occupied, cell_size, origin)
+
+    # Grayscale occupancy image (dark = occupied, one pixel per cell)
+    @classmethod
+    def from_image(cls, img_path, cell_size=2.0, origin=(0, 0), occupied_thresh=0.65):
+
+        import cv2
+
+        img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise ValueError(f"Could not read occupancy image: {img_path}")
+
+        # Same convention as a map_server image: occupancy = (255 - value) / 255
+        occupied = (255 - img.astype(float)) / 255 >= occupied_thresh
+
+        return cls(occupied, cell_size, origin)
+
+    '''
+    Vectorized DDA across all rays
+    Along each ray the cell boundary crossings of the x and y grid lines are evenly spaced, so they are generated in
+    closed form for every ray at once and merged by sorting. Consecutive crossings bound the cells the ray traverses
+    in order; the first occupied one is the hit, at the distance where the ray entered it
+    Returns the end point of each ray and a mask of rays that hit a wall within max_range (like Distance_Field.sphere_trace)
+    '''
+    def ray_march(self, origin, angles, max_range):
+
+        origin = np.asarray(origin, dtype=float)
+        dirs = np.column_stack((np.cos(angles), np.sin(angles)))
+        start = (origin - self.origin) / self.cell_size # Ray origin in cell units
+
+        # A ray of length max_range crosses at most this many grid lines per axis
+        k = np.arange(int(np.ceil(max_range / self.cell_size)) + 1)
+
+        crossings = []
+        for axis in (0, 1):
+            d = dirs[:, axis]
+            frac = start[axis] - np.floor(start[axis])
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                spacing = self.cell_size / np.abs(d) # Distance between crossings along the ray
+                first = np.where(d > 0, 1 - frac, frac) * spacing
+                t = first[:, None] + k[None, :] * spacing[:, None]
+
+            # Rays parallel to this axis' grid lines never cross them
+            crossings.append(np.where(d[:, None] != 0, t, np.inf))
+
+        zeros = np.zeros((len(dirs), 1))
+        bounds = np.concatenate([zeros] + crossings + [zeros + max_range], axis=1)
+        bounds = np.minimum(bounds, max_range)
+        bounds.sort(axis=1)
+
+        # Each cell is sampled at the middle of the ray's span inside it, well away from the boundaries
+        enter = bounds[:, :-1]
+        mid = (enter + bounds[:, 1:]) / 2
+        cols = np.floor(start[0] + dirs[:, 0, None] * mid / self.cell_size).astype(int)
+        rows = np.floor(start[1] + dirs[:, 1, None] * mid / self.cell_size).astype(int)
+
+        # Cells outside the grid are free
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1]) & (enter < max_range)
+        occupied = np.zeros(rows.shape, dtype=bool)
+        occupied[inside] = self.occupied[rows[inside], cols[inside]]
+
+        hit = occupied.any(axis=1)
+        first = occupied.argmax(axis=1)
+        t = np.where(hit, enter[np.arange(len(dirs)), first], max_range)
+
+        return origin + dirs * t[:, None], hit
@@ -0,0 +1,160 @@
+import os
+import sys
+import csv
+import ast
+import json
+import time
+import argparse
+import itertools
+import multiprocessing
+
+import main
+import map_sim_gen as msgen
+from benchmark import timed
+
+'''
+Parallel parameter sweep for Sim_Map_Generator
+Settings that share a prefix of the pipeline share its result: the thresholded/closed image and skeleton are computed
+once per (map, preprocessing, skeleton) group and the Hough lines once per line setting within it, so e.g. sweeping
+only thickness or merge_thresh re-runs nothing but the polygon stage
+Run: python param_sweep.py --maps scan1_livingroom room1 --param h_thresh 30 40 50 --param thickness 0 8 --out sweep.csv
+'''
+
+# Constructor parameters each pipeline stage depends on (a stage also depends on every stage before it)
+PREPROC_PARAMS = ("screen_width", "screen_height", "close_kernel_size", "close_iter")
+SKELETON_PARAMS = ("skel_mode",)
+LINE_PARAMS = ("h_thresh", "min_line_len", "max_line_gap")
+# Everything else (thickness, merge_thresh, join_style, simplify_tol, area_thresh, scale) only affects lines_to_polys
+
+def stage_key(params, names):
+
+    return tuple(params.get(name) for name in names)
+
+# Every combination of the grid values applied on top of the base parameters
+def expand_grid(base_params, grid):
+
+    names = sorted(grid)
+    return [{**base_params, **dict(zip(names, values))} for values in itertools.product(*(grid[name] for name in names))]
+
+# One task = settings that share the preprocessing and skeleton of one map
+def sweep_group(task):
+
+    map_path, settings = task
+    rows = []
+
+    generator = msgen.Sim_Map_Generator(map_path, **settings[0], cache_dir=None)
+
+    load_time, img = timed(generator.load_img, map_path)
+    if img is None:
+        return rows
+    preproc_time, preproc_img = timed(generator.preproc_img, img)
+    preproc_time += load_time
+    skeleton_time, skel_img = timed(generator.gen_skeleton, preproc_img)
+
+    lines_cache = {} # LINE_PARAMS values -> (line segments, detection time)
+    for idx, params in enumerate(settings):
+        generator = msgen.Sim_Map_Generator(map_path, **params, cache_dir=None)
+
+        line_key = stage_key(params, LINE_PARAMS)
+        lines_reused = line_key in lines_cache
+        if not lines_reused:
+            lines_time, line_segs = timed(generator.detect_lines, skel_img)
+            lines_cache[line_key] = (line_segs, lines_time)
+        line_segs, lines_time = lines_cache[line_key]
+
+        polys_time, polys = timed(generator.lines_to_polys, line_segs)
+
+        rows.append({
+            "map": map_path, **{name: repr(value) if isinstance(value, tuple) else value for name, value in params.items()},
+            "lines": len(line_segs), **generator.poly_counts(polys),
+            "preproc_s": preproc_time, "skeleton_s": skeleton_time, "lines_s": lines_time, "polys_s": polys_time,
+            # Shared stages were computed once for the whole group (or line setting) and reused here
+            "preproc_reused": idx > 0, "lines_reused": lines_reused,
+        })
+
+    return rows
+
+def make_tasks(map_params, grid, workers):
+
+    groups = {}
+    for map_path, base_params in map_params:
+        for params in expand_grid(base_params, grid):
+            key = (map_path, stage_key(params, PREPROC_PARAMS), stage_key(params, SKELETON_PARAMS))
+            groups.setdefault(key, []).append(params)
+
+    tasks = [(key[0], settings) for key, settings in groups.items()]
+
+    # Too few groups to keep every worker busy: split them per line setting (each part then redoes the cheap preprocessing)
+    if len(tasks) < workers:
+        split_tasks = []
+        for map_path, settings in tasks:
+            by_lines = {}
+            for params in settings:
+                by_lines.setdefault(stage_key(params, LINE_PARAMS), []).append(params)
+            split_tasks.extend((map_path, part) for part in by_lines.values())
+        tasks = split_tasks
+
+    return tasks
+
+'''
+map_params => list of (map path, base constructor parameters)
+grid => parameter name -> list of values to try
+'''
+def run_sweep(map_params, grid, workers=None):
+
+    workers = workers or os.cpu_count() or 1
+    tasks = make_tasks(map_params, grid, workers)
+
+    if workers == 1:
+        results = map(sweep_group, tasks)
+        return [row for rows in results for row in rows]
+
+    with multiprocessing.Pool(workers) as pool:
+        return [row for rows in pool.imap(sweep_group, tasks) for row in rows]
+
+def write_rows(rows, path):
+
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(rows, f, indent=2)
+        return
+
+    fields = list(dict.fromkeys(name for row in rows for name in row))
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+# Map names from main.MAP_CONFIGS use their tuned settings; other image paths start from the generator defaults
+def resolve_maps(maps):
+
+    resolved = []
+    for name in maps:
+        if name in main.MAP_CONFIGS:
+            resolved.append(main.MAP_CONFIGS[name])
+        else:
+            resolved.append((name, {}))
+
+    return resolved
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Sim_Map_Generator parameter sweep")
+    parser.add_argument("--maps", nargs="+", default=["scan1_livingroom"], help="map names from main.MAP_CONFIGS or image paths")
+    parser.add_argument("--param", nargs="+", action="append", default=[], metavar=("NAME", "VALUE"),
+                        help="parameter and the values to sweep (Python literals), e.g. --param close_kernel_size '(3, 3)' '(5, 5)'")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--out", default="sweep.csv", help="results file (.csv or .json)")
+    args = parser.parse_args()
+
+    grid = {}
+    for name, *values in args.param:
+        if not values:
+            parser.error(f"--param {name} needs at least one value")
+        grid[name] = [ast.literal_eval(value) for value in values]
+
+    start = time.perf_counter()
+    rows = run_sweep(resolve_maps(args.maps), grid, args.workers)
+    write_rows(rows, args.out)
+
+    print(f"{len(rows)} settings in {time.perf_counter() - start:.1f} s -> {args.out}", file=sys.stderr)
@@ -1,9 +1,5 @@
-import pygame
 import math
-
-import user
-from obstacle import Obst_Rect as Rect
-import sensor_sim
+import numpy as np
 
 class Pathfinder:
 
@@ -108,6 +104,11 @@ class Pathfinder:
         # Determines vector of obstacles
         repulsion_vector = (right_cnt - left_cnt, down_cnt - up_cnt)
 
+        return self.compute_net_path(user_pos, repulsion_vector, lidar_range, user_movement, obst_priority_weight, user_priority_weight)
+
+    '''Combine the obstacle repulsion with the user's desired direction into the path end point'''
+    def compute_net_path(self, user_pos, repulsion_vector, lidar_range, user_movement, obst_priority_weight=0.05, user_priority_weight=1.0):
+
         desired_dir = [0, 0]
         if user_movement[0]:
             desired_dir[0] -= 1
@@ -147,4 +148,75 @@ class Pathfinder:
         endpoint = (user_pos[0] + net_direction[0] * lidar_range,
                 user_pos[1] + net_direction[1] * lidar_range)
     
-        return endpoint, repulsion_vector, desired_dir, net_vector, net_direction
\ No newline at end of file
+        return endpoint, repulsion_vector, desired_dir, net_vector, net_direction
+
+    # Array versions: lidar_pts is an (N, 2) array and every point is handled in one vectorized pass
+
+    '''Projection of every lidar point onto the desired direction, (N, 2)'''
+    def compute_vector_projection_np(self, lidar_pts, user_pos, desired_dir):
+
+        lidar_pts = np.asarray(lidar_pts, dtype=float).reshape(-1, 2)
+        vector_v = lidar_pts - user_pos
+        vector_u = (desired_dir[0] - user_pos[0], desired_dir[1] - user_pos[1])
+        mag_u_squared = vector_u[0] ** 2 + vector_u[1] ** 2
+
+        # In the case no desired direction, return user position
+        if mag_u_squared == 0:
+            return np.tile(np.asarray(user_pos, dtype=float), (len(lidar_pts), 1))
+
+        k = (vector_v[:, 0] * vector_u[0] + vector_v[:, 1] * vector_u[1]) / mag_u_squared
+
+        # Same terms as compute_vector_projection so both versions give identical results
+        return np.column_stack((user_pos[0] + k * vector_u[0], user_pos[1] + k * vector_v[:, 1]))
+
+    '''Distance of every lidar point to the desired direction line, (N,)'''
+    def compute_dist_np(self, lidar_pts, user_pos, desired_dir):
+
+        lidar_pts = np.asarray(lidar_pts, dtype=float).reshape(-1, 2)
+        diff = lidar_pts - self.compute_vector_projection_np(lidar_pts, user_pos, desired_dir)
+
+        return np.hypot(diff[:, 0], diff[:, 1])
+
+    def compute_repulsion_control_pt_np(self, user_pos, desired_dir, lidar_pts, avoid_thresh=30, repulsion_factor=0.5):
+
+        lidar_pts = np.asarray(lidar_pts, dtype=float).reshape(-1, 2)
+
+        # The projection is computed once and reused for both the distance and the push direction
+        diff = lidar_pts - self.compute_vector_projection_np(lidar_pts, user_pos, desired_dir)
+        dist = np.hypot(diff[:, 0], diff[:, 1])
+        close = dist < avoid_thresh
+
+        diff = diff[close]
+        dist = dist[close]
+        # Normalize so only direction impacts the point (points on the line don't push)
+        safe_dist = np.where(dist != 0, dist, 1)
+        dirs = np.where((dist != 0)[:, None], diff / safe_dist[:, None], 0)
+
+        repulsion_amp = (avoid_thresh - dist) * repulsion_factor
+        repulsion = -(repulsion_amp[:, None] * dirs).sum(axis=0)
+
+        return (float(repulsion[0]), float(repulsion[1]))
+
+    '''Quadratic Bezier curve as a (num_pts, 2) array'''
+    def compute_quad_bezier_curve_np(self, P0, P1, P2, num_pts=20):
+
+        t = np.linspace(0, 1, num_pts)[:, None]
+
+        return (1 - t)**2 * np.asarray(P0, dtype=float) + 2 * (1 - t) * t * np.asarray(P1, dtype=float) + t**2 * np.asarray(P2, dtype=float)
+
+    def compute_path_np(self, user_pos, lidar_pts, lidar_range, user_movement, obst_priority_weight=0.05, user_priority_weight=1.0):
+
+        lidar_pts = np.asarray(lidar_pts, dtype=float).reshape(-1, 2)
+        x = lidar_pts[:, 0]
+        y = lidar_pts[:, 1]
+
+        # Quadrant counts; points level with the user on either axis belong to no quadrant
+        in_quadrant = (x != user_pos[0]) & (y != user_pos[1])
+        left_cnt = int(np.count_nonzero(in_quadrant & (x < user_pos[0])))
+        right_cnt = int(np.count_nonzero(in_quadrant & (x > user_pos[0])))
+        up_cnt = int(np.count_nonzero(in_quadrant & (y < user_pos[1])))
+        down_cnt = int(np.count_nonzero(in_quadrant & (y > user_pos[1])))
+
+        repulsion_vector = (right_cnt - left_cnt, down_cnt - up_cnt)
+
+        return self.compute_net_path(user_pos, repulsion_vector, lidar_range, user_movement, obst_priority_weight, user_priority_weight)
@@ -0,0 +1,175 @@
+import os
+import csv
+import json
+import time
+import threading
+from collections import deque
+import numpy as np
+import pygame
+
+# Stages Simulation times, in the order the overlay and dumps list them
+STAGES = ("lidar.simulate", "compute_slowdown", "compute_path", "compute_repulsion_control_pt", "bezier", "render_obstacles", "render_points", "frame")
+
+# Shared by every stage while profiling is off, so an untimed stage costs one call and an empty with block
+class Null_Timer:
+
+    __slots__ = ()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        return False
+
+NULL_TIMER = Null_Timer()
+
+class Stage_Timer:
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+        return False
+
+'''
+Per stage timings of the last window samples (the render loop and the sensor thread both record into it)
+Usage: with profiler.stage("compute_path"): ...
+dump_path => .csv or .json file the percentiles are appended to every dump_interval seconds (JSON as one object per line)
+'''
+class Frame_Profiler:
+
+    def __init__(self, enabled=False, window=600, dump_path=None, dump_interval=5.0):
+
+        self.enabled = enabled
+        self.requested = enabled # Timing asked for up front (--profile); the overlay never turns that off
+        self.window = window
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.overlay = False # Drawn by render() when set (F3 in the window)
+
+        self.lock = threading.Lock()
+        self.samples = {} # Stage name -> deque of seconds
+        self.counts = {} # Stage name -> samples recorded since the start (not just the window)
+        self.last_dump = time.perf_counter()
+        self.overlay_summary = None # (time, rendered table cells) so the overlay doesn't recompute percentiles every frame
+        self.font = None # Monospace so the columns line up, created on first use
+
+    def stage(self, name):
+
+        return Stage_Timer(self, name) if self.enabled else NULL_TIMER
+
+    def add(self, name, seconds):
+
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+                self.counts[name] = 0
+            self.samples[name].append(seconds)
+            self.counts[name] += 1
+
+    # Overlay on means timing on; off stops timing again unless it was requested up front or results are being dumped
+    def toggle_overlay(self):
+
+        self.overlay = not self.overlay
+        self.enabled = self.requested or self.overlay or self.dump_path is not None
+
+    # {stage: {"count", "mean", "p50", "p95", "p99"}} with times in milliseconds, stages in STAGES order first
+    def summary(self):
+
+        with self.lock:
+            snapshot = {name: (np.array(samples), self.counts[name]) for name, samples in self.samples.items() if samples}
+
+        names = [name for name in STAGES if name in snapshot] + sorted(name for name in snapshot if name not in STAGES)
+        summary = {}
+        for name in names:
+            ms, count = snapshot[name][0] * 1000, snapshot[name][1]
+            p50, p95, p99 = np.percentile(ms, (50, 95, 99))
+            summary[name] = {"count": count, "mean": float(ms.mean()), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+        return summary
+
+    # Dumps when dump_interval has passed since the last dump (call once per frame)
+    def tick(self, now=None):
+
+        if not self.enabled or self.dump_path is None:
+            return
+
+        now = time.perf_counter() if now is None else now
+        if now - self.last_dump >= self.dump_interval:
+            self.dump()
+
+    def dump(self, path=None):
+
+        path = path or self.dump_path
+        self.last_dump = time.perf_counter()
+        summary = self.summary()
+        stamp = time.time()
+
+        if path.endswith(".json"):
+            with open(path, "a") as f:
+                f.write(json.dumps({"time": stamp, "stages": summary}) + "\n")
+            return
+
+        new_file = not os.path.isfile(path) or os.path.getsize(path) == 0
+        with open(path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(["time", "stage", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+            for name, row in summary.items():
+                writer.writerow([f"{stamp:.3f}", name, row["count"]] + [f"{row[key]:.4f}" for key in ("mean", "p50", "p95", "p99")])
+
+    # Rows of (stage, p50, p95, p99) text, header first
+    def table(self, summary=None):
+
+        summary = self.summary() if summary is None else summary
+        rows = [("stage", "p50 ms", "p95 ms", "p99 ms")]
+        for name, row in summary.items():
+            rows.append((name, f"{row['p50']:.3f}", f"{row['p95']:.3f}", f"{row['p99']:.3f}"))
+
+        return rows
+
+    def format_lines(self, summary=None):
+
+        return [f"{name:<30}{p50:>10}{p95:>10}{p99:>10}" for (name, p50, p95, p99) in self.table(summary)]
+
+    # Percentile table below the rate readout, refreshed a few times a second
+    def render(self, screen, pos=(10, 34), refresh=0.25):
+
+        if not self.overlay:
+            return
+
+        if self.font is None:
+            self.font = pygame.font.SysFont("monospace", 14)
+
+        now = time.perf_counter()
+        if self.overlay_summary is None or now - self.overlay_summary[0] >= refresh:
+            # Rendered cell by cell so the columns line up whatever the font
+            cells = [[self.font.render(text, True, (255, 255, 255)) for text in row] for row in self.table()]
+            self.overlay_summary = (now, cells)
+
+        cells = self.overlay_summary[1]
+        widths = [max(row[col].get_width() for row in cells) + 12 for col in range(4)]
+        line_h = self.font.get_linesize()
+
+        x, y = pos
+        pygame.draw.rect(screen, (0, 0, 0), (x - 4, y - 2, sum(widths) + 4, line_h * len(cells) + 4))
+        for row in cells:
+            right = x + widths[0]
+            screen.blit(row[0], (x, y))
+            for col in range(1, 4):
+                right += widths[col]
+                screen.blit(row[col], (right - 12 - row[col].get_width(), y))
+            y += line_h
@@ -0,0 +1,111 @@
+import math
+import numpy as np
+import pygame
+
+from obstacle import as_obst_set
+
+'''
+Static wall geometry drawn once into cached tiles
+Each frame only blits the tiles overlapping the camera, so render cost no longer depends on the map's vertex count
+Tiles are opaque (black background) so the layer must be drawn first, right after clearing the screen
+'''
+class Static_Map_Layer:
+
+    def __init__(self, objs, color=(0, 0, 255), width=2, tile_size=512):
+
+        self.color = color
+        self.width = width
+        self.tile_size = tile_size
+
+        # Integer outlines (same rounding as drawing them every frame) with their bounding boxes
+        obst_set = as_obst_set(objs)
+        int_coords = obst_set.coords.astype(int)
+        self.polys = [ring.tolist() for ring in np.split(int_coords, obst_set.offsets[1:-1])] if len(obst_set) else []
+        self.bounds = np.empty((0, 4))
+        if len(obst_set):
+            starts = obst_set.offsets[:-1]
+            self.bounds = np.column_stack((np.minimum.reduceat(int_coords, starts) - width, np.maximum.reduceat(int_coords, starts) + width)).astype(float)
+        self.tiles = {} # (tx, ty) -> Surface, or None for tiles without walls
+
+    # Tiles are drawn the first time they come into view and kept afterwards
+    def get_tile(self, tx, ty):
+
+        if (tx, ty) in self.tiles:
+            return self.tiles[(tx, ty)]
+
+        left = tx * self.tile_size
+        top = ty * self.tile_size
+        b = self.bounds
+        overlap = np.flatnonzero((b[:, 0] < left + self.tile_size) & (b[:, 2] >= left) & (b[:, 1] < top + self.tile_size) & (b[:, 3] >= top))
+
+        tile = None
+        if len(overlap):
+            tile = pygame.Surface((self.tile_size, self.tile_size))
+            # Match the display format when there is one so blits don't convert every frame
+            if pygame.display.get_surface() is not None:
+                tile = tile.convert()
+
+            for idx in overlap:
+                pts = [(x - left, y - top) for (x, y) in self.polys[idx]]
+                pygame.draw.polygon(tile, self.color, pts, width=self.width)
+
+        self.tiles[(tx, ty)] = tile
+        return tile
+
+    def render(self, screen, cam_pos):
+
+        cam_x = math.floor(cam_pos[0])
+        cam_y = math.floor(cam_pos[1])
+        view_w, view_h = screen.get_size()
+
+        # Range of tiles overlapping the view
+        first_tx = math.floor(cam_x / self.tile_size)
+        first_ty = math.floor(cam_y / self.tile_size)
+        last_tx = math.floor((cam_x + view_w - 1) / self.tile_size)
+        last_ty = math.floor((cam_y + view_h - 1) / self.tile_size)
+
+        blits = []
+        for tx in range(first_tx, last_tx + 1):
+            for ty in range(first_ty, last_ty + 1):
+                tile = self.get_tile(tx, ty)
+
+                if tile is not None:
+                    # Float offsets so the tiles round the same way as the dynamic layers drawn on top
+                    blits.append((tile, (tx * self.tile_size - cam_pos[0], ty * self.tile_size - cam_pos[1])))
+
+        screen.blits(blits, doreturn=False)
+
+'''
+Draws many small dots (e.g. lidar hits) in one batch by writing a precomputed disc footprint straight into the
+screen's pixel array. Points outside the view are culled by the same array operations
+'''
+class Point_Layer:
+
+    def __init__(self, color=(255, 0, 0), radius=2):
+
+        self.color = color
+        self.radius = radius
+
+        # Pixel offsets covered by a filled disc of the given radius
+        span = np.arange(-radius, radius + 1)
+        dx, dy = np.meshgrid(span, span, indexing='ij')
+        inside = dx * dx + dy * dy <= radius * radius
+        self.offsets = np.column_stack((dx[inside], dy[inside]))
+
+    def render(self, screen, pts, cam_pos):
+
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        if len(pts) == 0:
+            return
+
+        view_w, view_h = screen.get_size()
+        centres = np.rint(pts - np.asarray(cam_pos, dtype=float)).astype(int)
+
+        # Every pixel of every dot, keeping only the ones on screen
+        xs = (centres[:, None, 0] + self.offsets[None, :, 0]).ravel()
+        ys = (centres[:, None, 1] + self.offsets[None, :, 1]).ravel()
+        on_screen = (xs >= 0) & (xs < view_w) & (ys >= 0) & (ys < view_h)
+
+        pixels = pygame.surfarray.pixels2d(screen)
+        pixels[xs[on_screen], ys[on_screen]] = screen.map_rgb(self.color)
+        del pixels # Unlock the surface
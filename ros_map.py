@@ -0,0 +1,281 @@
+import os
+import numpy as np
+from shapely.geometry import LineString, Polygon, box
+from shapely.ops import split, unary_union
+
+import occupancy_grid
+from scan_source import PIXELS_PER_METER
+
+'''
+Maps saved by ROS map_server / map_saver (e.g. from cartographer or slam_toolbox): a grayscale image plus a YAML file
+with the resolution (meters per pixel) and the world pose of the image's bottom left pixel
+The image is read at its native resolution, one cell per pixel, and placed in world pixels with y pointing down
+(world x = x_m * pixels_per_meter, world y = -y_m * pixels_per_meter), the same convention as scan_source
+'''
+
+# map_server defaults for the optional keys
+MAP_YAML_DEFAULTS = {"negate": 0, "occupied_thresh": 0.65, "free_thresh": 0.196, "mode": "trinary", "origin": [0.0, 0.0, 0.0]}
+
+def parse_yaml_value(value):
+
+    value = value.strip()
+
+    if value.startswith("[") and value.endswith("]"):
+        return [parse_yaml_value(item) for item in value[1:-1].split(",") if item.strip()]
+
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+        return value[1:-1]
+
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+
+    return value
+
+# The flat "key: value" subset of YAML that map_saver writes (no nesting beyond inline lists)
+def parse_map_yaml(text):
+
+    meta = {}
+    for line in text.splitlines():
+        line = line.split(" #")[0].strip()
+        if not line or line.startswith("#"):
+            continue
+
+        key, sep, value = line.partition(":")
+        if not sep:
+            raise ValueError(f"Malformed map YAML line: {line}")
+        meta[key.strip()] = parse_yaml_value(value)
+
+    return meta
+
+# Map YAML with defaults filled in and the image path resolved relative to the YAML file
+def read_map_yaml(yaml_path):
+
+    with open(yaml_path) as f:
+        meta = {**MAP_YAML_DEFAULTS, **parse_map_yaml(f.read())}
+
+    for key in ("image", "resolution"):
+        if key not in meta:
+            raise ValueError(f"Map YAML {yaml_path} has no {key}")
+
+    meta["image"] = os.path.join(os.path.dirname(yaml_path), meta["image"])
+
+    return meta
+
+# Header of a binary (P5) PGM: (width, height, maxval, offset of the pixel data)
+def read_pgm_header(path):
+
+    with open(path, "rb") as f:
+        head = f.read(1024)
+
+    tokens = []
+    pos = 0
+    while len(tokens) < 4:
+        # Skip whitespace and comments between tokens
+        while pos < len(head) and (head[pos:pos + 1].isspace() or head[pos:pos + 1] == b"#"):
+            if head[pos:pos + 1] == b"#":
+                pos = head.find(b"\n", pos)
+                pos = len(head) if pos < 0 else pos
+            pos += 1
+
+        start = pos
+        while pos < len(head) and not head[pos:pos + 1].isspace():
+            pos += 1
+        if start == pos:
+            raise ValueError(f"Truncated PGM header: {path}")
+        tokens.append(head[start:pos])
+
+    if tokens[0] != b"P5":
+        raise ValueError(f"Not a binary PGM: {path}")
+
+    # Exactly one whitespace byte separates maxval from the pixels
+    width, height, maxval = (int(token) for token in tokens[1:])
+
+    return width, height, maxval, pos + 1
+
+'''
+Map image as a (height, width) array plus its maxval
+A P5 PGM is memory mapped straight from the file, so only the pixels that get looked at are read; other formats
+(map_server also accepts PNG and the like) are decoded with cv2
+'''
+def read_map_image(path):
+
+    if path.lower().endswith(".pgm"):
+        width, height, maxval, offset = read_pgm_header(path)
+        dtype = "u1" if maxval < 256 else ">u2" # 16 bit PGMs are big endian
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(height, width)), maxval
+
+    import cv2
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError(f"Could not read map image: {path}")
+
+    return img, 255
+
+'''
+Exact decomposition of a (rows, cols) mask into (row, col, height, width) rectangles
+Runs of True cells are found per row with array operations; a run continues the rectangle above it when that
+rectangle's run has the same columns, so every rectangle is completely True
+'''
+def mask_rects(mask):
+
+    mask = np.asarray(mask, dtype=bool)
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    start_rows, start_cols = np.nonzero(edges == 1)
+    _, end_cols = np.nonzero(edges == -1) # Same row major order, so paired with the starts
+
+    rects = []
+    open_runs = {} # (start col, end col) => first row of its rectangle, for the runs of prev_row
+    prev_row = None
+
+    if len(start_rows) == 0:
+        return rects
+
+    row_starts = np.flatnonzero(np.diff(start_rows)) + 1
+    for row, starts, ends in zip(start_rows[np.r_[0, row_starts]].tolist(), np.split(start_cols, row_starts), np.split(end_cols, row_starts)):
+        runs = set(zip(starts.tolist(), ends.tolist()))
+        continued = open_runs if prev_row == row - 1 else {}
+
+        # Rectangles whose run does not carry on into this row are finished
+        for run, top in open_runs.items():
+            if run not in continued or run not in runs:
+                rects.append((top, run[0], prev_row - top + 1, run[1] - run[0]))
+
+        open_runs = {run: continued.get(run, row) for run in runs}
+        prev_row = row
+
+    for run, top in open_runs.items():
+        rects.append((top, run[0], prev_row - top + 1, run[1] - run[0]))
+
+    return rects
+
+# Splits a polygon with holes into hole free pieces (walls are treated as filled, so a ring would fill its room)
+def split_holes(poly, cell_size):
+
+    if not poly.interiors:
+        return [poly]
+
+    # Through the middle of the hole's leftmost cell column: crosses the hole, never runs along a wall edge
+    min_x, _, _, _ = Polygon(poly.interiors[0]).bounds
+    x = min_x + cell_size / 2
+    _, min_y, _, max_y = poly.bounds
+    cut = LineString([(x, min_y - 1), (x, max_y + 1)])
+
+    return [piece for part in split(poly, cut).geoms for piece in split_holes(part, cell_size)]
+
+class Ros_Map:
+
+    def __init__(self, yaml_path, pixels_per_meter=PIXELS_PER_METER):
+
+        self.meta = read_map_yaml(yaml_path)
+        self.pixels, self.maxval = read_map_image(self.meta["image"])
+
+        self.resolution = float(self.meta["resolution"]) # Meters per cell
+        self.origin_m = [float(v) for v in self.meta["origin"]] # (x, y, yaw) of the bottom left cell
+        self.negate = bool(self.meta["negate"])
+        self.occupied_thresh = float(self.meta["occupied_thresh"])
+        self.free_thresh = float(self.meta["free_thresh"])
+        self.mode = self.meta["mode"]
+        self.pixels_per_meter = pixels_per_meter
+        self.cell_size = self.resolution * pixels_per_meter # World pixels per cell
+
+        if self.mode not in ("trinary", "scale", "raw"):
+            raise ValueError(f"Unknown map mode: {self.mode}")
+
+        if len(self.origin_m) > 2 and self.origin_m[2] != 0:
+            print(f"Warning: map origin yaw {self.origin_m[2]} ignored, the map is loaded axis aligned")
+
+        height = self.pixels.shape[0]
+        # Image row 0 is the top of the map, i.e. the largest y in meters and the smallest world y
+        self.origin = (self.origin_m[0] * pixels_per_meter, -(self.origin_m[1] + height * self.resolution) * pixels_per_meter)
+
+    # Meter coordinates (y up) to world pixels (y down)
+    def world_to_sim(self, pts):
+
+        pts = np.asarray(pts, dtype=float) * self.pixels_per_meter
+
+        return pts * np.array([1, -1])
+
+    '''
+    Occupancy probabilities (0 to 100, -1 unknown) the way map_server interprets the image
+    trinary => 100 occupied, 0 free, -1 in between. scale => in between values scale linearly
+    raw => pixel values (0 to 255, inverted with negate) are the probabilities, anything above 100 is unknown
+    '''
+    def probabilities(self):
+
+        if self.mode == "raw":
+            value = np.asarray(self.pixels, dtype=float) * (255 / self.maxval)
+            if self.negate:
+                value = 255 - value
+            value = np.rint(value)
+            return np.where(value > 100, -1, value).astype(np.int16)
+
+        occ = np.asarray(self.pixels, dtype=float) / self.maxval
+        if not self.negate:
+            occ = 1 - occ
+
+        probs = np.full(occ.shape, -1, dtype=np.int16)
+        if self.mode == "scale":
+            between = 99 * (occ - self.free_thresh) / (self.occupied_thresh - self.free_thresh)
+            probs = np.where((occ > self.free_thresh) & (occ < self.occupied_thresh), np.rint(between), -1).astype(np.int16)
+
+        probs[occ > self.occupied_thresh] = 100
+        probs[occ < self.free_thresh] = 0
+
+        return probs
+
+    '''
+    (rows, cols) mask of the cells that count as walls, as map_server decides them: cells it marks 100 in trinary and
+    scale mode (occupancy above occupied_thresh; scaled in between values never are), values above occupied_thresh
+    in raw mode. Unknown cells are walls only with unknown_occupied
+    '''
+    def occupied(self, unknown_occupied=False):
+
+        probs = self.probabilities()
+        occupied = probs > self.occupied_thresh * 100 if self.mode == "raw" else probs == 100
+
+        if unknown_occupied:
+            occupied |= probs < 0
+
+        return occupied
+
+    # Native resolution grid for the "grid" LiDAR backend
+    def occupancy_grid(self, unknown_occupied=False):
+
+        return occupancy_grid.Occupancy_Grid(self.occupied(unknown_occupied), self.cell_size, self.origin)
+
+    '''
+    Wall polygons (world pixels) covering the occupied cells exactly
+    The cells are decomposed into rectangles, merged, and any wall enclosing free space is split into hole free pieces
+    simplify_tol => Douglas-Peucker tolerance in world pixels to straighten the staircase of diagonal walls
+    '''
+    def wall_polys(self, simplify_tol=0.0, unknown_occupied=False):
+
+        mask = self.occupied(unknown_occupied)
+        origin_x, origin_y = self.origin
+        size = self.cell_size
+
+        boxes = [box(origin_x + col * size, origin_y + row * size, origin_x + (col + w) * size, origin_y + (row + h) * size)
+                 for (row, col, h, w) in mask_rects(mask)]
+        if not boxes:
+            return []
+
+        merged = unary_union(boxes)
+        merged = list(merged.geoms) if hasattr(merged, "geoms") else [merged]
+
+        polys = []
+        for poly in merged:
+            for piece in split_holes(poly, size):
+                if simplify_tol > 0:
+                    piece = piece.simplify(simplify_tol, preserve_topology=True)
+                if not piece.is_empty and piece.area > 0:
+                    polys.append(list(piece.exterior.coords)[:-1])
+
+        return polys
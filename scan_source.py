@@ -0,0 +1,360 @@
+import sys
+import abc
+import json
+import time
+import socket
+import struct
+import argparse
+import threading
+import functools
+from collections import namedtuple
+import numpy as np
+
+'''
+Scan sources feed Simulation.pathfinder_logic with the lidar hits of the newest frame
+scan(origin) returns them as an (N, 2) array in world pixels; origin is where the user (robot) currently is, which
+real scans (ranges relative to the sensor) need to be placed in the world
+'''
+
+# So the robot's 3.5 m LDS max range (lidar_bot_code/lds_2d.lua) spans the simulated 200 px LiDAR range
+PIXELS_PER_METER = 200 / 3.5
+
+# One LaserScan-style frame. angles => explicit beam angles (radians) or None for angle_min + i * angle_increment
+Scan_Frame = namedtuple("Scan_Frame", ["stamp", "angle_min", "angle_increment", "range_min", "range_max", "ranges", "angles"], defaults=[None])
+
+# Unit vectors of every beam, computed once per scan layout
+@functools.lru_cache(maxsize=8)
+def beam_dirs(num_beams, angle_min, angle_increment):
+
+    angles = angle_min + np.arange(num_beams) * angle_increment
+    dirs = np.column_stack((np.cos(angles), np.sin(angles)))
+    dirs.flags.writeable = False
+
+    return dirs
+
+'''
+Converts a frame's ranges (meters) to world points around origin in one batch
+Beams outside [range_min, range_max] or without a return (inf/nan) are dropped
+flip_y => ROS angles are counter clockwise with y up while screen y points down
+'''
+def ranges_to_points(frame, origin, scale=PIXELS_PER_METER, flip_y=True):
+
+    ranges = np.asarray(frame.ranges, dtype=float)
+
+    if frame.angles is not None:
+        angles = np.asarray(frame.angles, dtype=float)
+        dirs = np.column_stack((np.cos(angles), np.sin(angles)))
+    else:
+        dirs = beam_dirs(len(ranges), float(frame.angle_min), float(frame.angle_increment))
+
+    valid = np.isfinite(ranges) & (ranges >= frame.range_min) & (ranges <= frame.range_max)
+    offsets = dirs[valid] * (ranges[valid] * scale)[:, None]
+
+    if flip_y:
+        offsets[:, 1] = -offsets[:, 1]
+
+    return np.asarray(origin, dtype=float) + offsets
+
+# Interface every scan source implements (a subclass without scan() can't be instantiated)
+class Scan_Source(abc.ABC):
+
+    # Lidar hits of the newest frame around origin as an (N, 2) array
+    @abc.abstractmethod
+    def scan(self, origin):
+
+        pass
+
+    # True once the source will never produce another new frame
+    @property
+    def done(self):
+
+        return False
+
+    def close(self):
+
+        pass
+
+# The simulated sensor (origin is implied by the sensor's user)
+class Sim_Scan_Source(Scan_Source):
+
+    def __init__(self, lidar, objs, index=None, num_rays=180):
+
+        self.lidar = lidar
+        self.objs = objs
+        self.index = index
+        self.num_rays = num_rays
+
+    def scan(self, origin):
+
+        return self.lidar.simulate(self.num_rays, self.objs, self.index)
+
+'''
+Reads recorded scans lazily, one JSON object per line with the Scan_Frame fields
+(e.g. {"stamp": 0.1, "angle_min": -3.14, "angle_increment": 0.0175, "range_min": 0.1, "range_max": 3.5, "ranges": [...]})
+Ranges written as null (no return) become inf
+'''
+def read_scan_file(path):
+
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            data = json.loads(line)
+            ranges = np.array([np.inf if r is None else r for r in data["ranges"]], dtype=float)
+            yield Scan_Frame(data.get("stamp", 0.0), data.get("angle_min", 0.0), data.get("angle_increment", 0.0),
+                             data.get("range_min", 0.0), data.get("range_max", np.inf), ranges, data.get("angles"))
+
+def write_scan_file(path, frames):
+
+    with open(path, "w") as f:
+        for frame in frames:
+            data = frame._asdict()
+            data["ranges"] = [float(r) if np.isfinite(r) else None for r in frame.ranges]
+            if frame.angles is None:
+                del data["angles"]
+            else:
+                data["angles"] = [float(a) for a in frame.angles]
+            f.write(json.dumps(data) + "\n")
+
+'''
+Replays frames from any iterable (e.g. read_scan_file)
+realtime => follow the frame stamps against the wall clock, skipping frames that are already stale and repeating
+            the newest one until the next is due. Otherwise every scan() call takes the next frame
+The last frame keeps being returned once the frames run out
+'''
+class Recorded_Scan_Source(Scan_Source):
+
+    def __init__(self, frames, scale=PIXELS_PER_METER, realtime=False):
+
+        self.frames = iter(frames)
+        self.scale = scale
+        self.realtime = realtime
+        self.frame = None
+        self.pending = None # Next frame, read ahead in realtime mode
+        self.exhausted = False
+        self.start = None # (wall clock, stamp) of the first frame
+
+    def next_frame(self):
+
+        if self.pending is not None:
+            frame, self.pending = self.pending, None
+            return frame
+
+        frame = next(self.frames, None)
+        if frame is None:
+            self.exhausted = True
+
+        return frame
+
+    def advance(self):
+
+        if not self.realtime:
+            frame = self.next_frame()
+            self.frame = frame if frame is not None else self.frame
+            return
+
+        now = time.perf_counter()
+        while not self.exhausted:
+            frame = self.next_frame()
+            if frame is None:
+                break
+
+            if self.start is None:
+                self.start = (now, frame.stamp)
+
+            # Not due yet: keep it for a later call
+            if frame.stamp - self.start[1] > now - self.start[0]:
+                self.pending = frame
+                break
+
+            self.frame = frame
+
+    def scan(self, origin):
+
+        self.advance()
+
+        if self.frame is None:
+            return np.empty((0, 2))
+
+        return ranges_to_points(self.frame, origin, self.scale)
+
+    @property
+    def done(self):
+
+        return self.exhausted and self.pending is None
+
+'''
+Wire format of one frame (one UDP datagram): header then count float32 ranges, all little endian
+magic, sequence number, stamp, angle_min, angle_increment, range_min, range_max, count, flags
+With FRAME_ANGLES set in flags, count float32 beam angles follow the ranges (frames with explicit angles)
+'''
+FRAME_HEADER = struct.Struct("<4sIdffffII")
+FRAME_MAGIC = b"SCN2"
+FRAME_ANGLES = 1
+
+def encode_frame(frame, seq=0):
+
+    ranges = np.asarray(frame.ranges, dtype="<f4")
+    flags = 0 if frame.angles is None else FRAME_ANGLES
+    header = FRAME_HEADER.pack(FRAME_MAGIC, seq, frame.stamp, frame.angle_min, frame.angle_increment, frame.range_min, frame.range_max, len(ranges), flags)
+
+    if frame.angles is None:
+        return header + ranges.tobytes()
+
+    angles = np.asarray(frame.angles, dtype="<f4")
+    if len(angles) != len(ranges):
+        raise ValueError(f"Frame has {len(ranges)} ranges but {len(angles)} angles")
+
+    return header + ranges.tobytes() + angles.tobytes()
+
+# Returns (seq, frame) or None for a malformed datagram
+def decode_frame(data):
+
+    if len(data) < FRAME_HEADER.size:
+        return None
+
+    magic, seq, stamp, angle_min, angle_increment, range_min, range_max, count, flags = FRAME_HEADER.unpack_from(data)
+    blocks = 2 if flags & FRAME_ANGLES else 1
+    if magic != FRAME_MAGIC or len(data) != FRAME_HEADER.size + blocks * count * 4:
+        return None
+
+    ranges = np.frombuffer(data, dtype="<f4", count=count, offset=FRAME_HEADER.size)
+    angles = np.frombuffer(data, dtype="<f4", count=count, offset=FRAME_HEADER.size + count * 4) if flags & FRAME_ANGLES else None
+
+    return seq, Scan_Frame(stamp, angle_min, angle_increment, range_min, range_max, ranges, angles)
+
+'''
+Listens for frames on a local UDP socket
+A background thread drains the socket as fast as frames arrive and only keeps the newest one, so a slow consumer
+never works through a backlog: frames it did not get to are dropped (counted in dropped), and only the frame that
+is actually consumed gets converted to points
+'''
+class Socket_Scan_Source(Scan_Source):
+
+    def __init__(self, host="127.0.0.1", port=5005, scale=PIXELS_PER_METER, timeout=0.2):
+
+        self.scale = scale
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(timeout) # Lets the thread notice close()
+        self.address = self.sock.getsockname()
+
+        self.lock = threading.Lock()
+        self.latest = None # Newest (seq, frame) not consumed yet
+        self.frame = None # Last consumed frame
+        self.received = 0
+        self.dropped = 0 # Frames overwritten before anyone consumed them
+        self.invalid = 0
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.listen, name="scan-listener", daemon=True)
+        self.thread.start()
+
+    def listen(self):
+
+        while not self.stop_event.is_set():
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+
+            decoded = decode_frame(data)
+
+            with self.lock:
+                if decoded is None:
+                    self.invalid += 1
+                    continue
+
+                self.received += 1
+
+                # Out of order datagrams older than the pending frame are stale too
+                if self.latest is not None:
+                    self.dropped += 1
+                    if decoded[0] < self.latest[0]:
+                        continue
+                self.latest = decoded
+
+    def scan(self, origin):
+
+        with self.lock:
+            latest, self.latest = self.latest, None
+
+        if latest is not None:
+            self.frame = latest[1]
+
+        if self.frame is None:
+            return np.empty((0, 2))
+
+        return ranges_to_points(self.frame, origin, self.scale)
+
+    def close(self):
+
+        self.stop_event.set()
+        self.thread.join()
+        self.sock.close()
+
+# Frames of a robot standing in a box shaped room (meters), slowly drifting so consecutive frames differ
+def synthetic_scans(num_beams=360, room=(4.0, 3.0), range_min=0.1, range_max=3.5, rate=10.0, noise=0.01, seed=0):
+
+    rng = np.random.default_rng(seed)
+    angle_increment = 2 * np.pi / num_beams
+    dirs = beam_dirs(num_beams, -np.pi, angle_increment)
+    half = np.asarray(room, dtype=float) / 2
+    frame_idx = 0
+
+    while True:
+        stamp = frame_idx / rate
+        pos = 0.5 * half * np.array([np.sin(stamp * 0.5), np.sin(stamp * 0.3)])
+
+        # Distance to the wall each beam faces
+        with np.errstate(divide='ignore'):
+            wall_t = (np.where(dirs > 0, half, -half) - pos) / dirs
+        ranges = np.min(np.where(np.isfinite(wall_t) & (wall_t > 0), wall_t, np.inf), axis=1)
+        ranges = ranges + rng.normal(0, noise, num_beams)
+        ranges[ranges > range_max] = np.inf
+
+        yield Scan_Frame(stamp, -np.pi, angle_increment, range_min, range_max, ranges)
+        frame_idx += 1
+
+'''
+Stand-in for the robot: sends frames to a Socket_Scan_Source at a fixed rate
+Run: python scan_source.py --port 5005 --rate 10 (synthetic room) or --file scans.jsonl (recorded frames)
+'''
+def publish_scans(frames, host="127.0.0.1", port=5005, rate=10.0, max_frames=None):
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    period = 1.0 / rate
+    next_time = time.perf_counter()
+    sent = 0
+
+    try:
+        for frame in frames:
+            if max_frames is not None and sent >= max_frames:
+                break
+
+            sock.sendto(encode_frame(frame, seq=sent), (host, port))
+            sent += 1
+
+            next_time += period
+            time.sleep(max(0.0, next_time - time.perf_counter()))
+    finally:
+        sock.close()
+
+    return sent
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Stand-in scan publisher")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5005)
+    parser.add_argument("--rate", type=float, default=10.0, help="frames per second")
+    parser.add_argument("--file", help="recorded scans (JSON lines) to send instead of a synthetic room")
+    parser.add_argument("--frames", type=int, default=None, help="stop after this many frames")
+    args = parser.parse_args()
+
+    frames = read_scan_file(args.file) if args.file else synthetic_scans(rate=args.rate)
+    sent = publish_scans(frames, args.host, args.port, args.rate, args.frames)
+    print(f"Sent {sent} frames to {args.host}:{args.port}", file=sys.stderr)
@@ -0,0 +1,96 @@
+import time
+import threading
+from collections import deque
+
+# Measured rate of a repeating event over a sliding time window
+class Rate_Meter:
+
+    def __init__(self, window=1.0):
+
+        self.window = window # Seconds of history the rate is averaged over
+        self.stamps = deque()
+
+    def tick(self, now=None):
+
+        now = time.perf_counter() if now is None else now
+        self.stamps.append(now)
+
+        while self.stamps[0] < now - self.window:
+            self.stamps.popleft()
+
+    def rate(self):
+
+        if len(self.stamps) < 2:
+            return 0.0
+
+        elapsed = self.stamps[-1] - self.stamps[0]
+        return (len(self.stamps) - 1) / elapsed if elapsed > 0 else 0.0
+
+# Position the sensor thread scans from, copied from the user once per step so a scan never mixes two positions
+class Sensor_Pose:
+
+    __slots__ = ("pos",)
+
+    def __init__(self, pos=(0, 0)):
+
+        self.pos = pos
+
+'''
+Calls step() at a fixed rate on a background thread
+Steps that overrun their period are not made up for: the schedule restarts from the late step so a slow step lowers
+the achieved rate instead of causing a burst of back to back steps
+Results are handed over by step itself (see Simulation.sensor_step); the loop only keeps time
+'''
+class Fixed_Rate_Loop:
+
+    def __init__(self, step, rate):
+
+        self.step = step
+        self.period = 1.0 / rate
+        self.meter = Rate_Meter()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.error = None # Exception that stopped the loop, re-raised by check()
+
+    def start(self):
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="sensor-loop", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+
+        next_time = time.perf_counter()
+
+        while not self.stop_event.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                self.error = e
+                return
+
+            now = time.perf_counter()
+            self.meter.tick(now)
+
+            next_time += self.period
+            if next_time < now:
+                next_time = now
+
+            self.stop_event.wait(next_time - now)
+
+    # Surfaces an exception from the loop's thread on the calling thread
+    def check(self):
+
+        if self.error is not None:
+            raise self.error
+
+    def rate(self):
+
+        return self.meter.rate()
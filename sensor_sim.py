@@ -1,21 +1,97 @@
 import math
-from shapely.geometry import Point, Polygon, LineString
+import numpy as np
+from shapely.geometry import Point, LineString
+
+import spatial_index
+from obstacle import as_obst_set
 
 class LiDAR_Sensor:
 
-    def __init__(self, user, range=12, fov=360, speed=4500):
+    '''
+    incremental => numpy backend only: re-test each ray against the edges it and its neighbouring rays hit last scan,
+                   verified against an edge grid, before falling back to a full search (see search_coherent)
+    edge_cell => with incremental, cell size in world pixels of the edge grid the kept hits are verified with
+    '''
+    def __init__(self, user, range=12, fov=360, speed=4500, backend="shapely", distance_field=None, occupancy_grid=None, incremental=False, edge_cell=16):
 
         self.range = range  # range measured in pixels
         self.speed = speed  # rotations per second
         self.user = user
         self.fov = fov  # field of vision (360 for a LiDAR)
-        self.lidar_pts = []
+        self.backend = backend  # "shapely" (per ray GEOS intersections), "numpy" (batched ray/edge solve), "sphere" (sphere tracing) or "grid" (DDA ray march)
+        self.distance_field = distance_field # distance_field.Distance_Field of the map, required by the "sphere" backend
+        self.occupancy_grid = occupancy_grid # occupancy_grid.Occupancy_Grid of the map, required by the "grid" backend
+        self.lidar_pts = np.empty((0, 2))
+
+        # Flattened obstacle edges for the numpy backend, rebuilt only when the obstacle list changes
+        self.edge_objs = None
+        self.edge_set = None # Obst_Set the edge arrays belong to
+        self.edge_starts = None
+        self.edge_vecs = None
+        self.edge_offsets = None # Edges of objs[i] are edge_offsets[i]:edge_offsets[i + 1]
+        self.edge_obj_ids = None # Obstacle index of every edge
+        self.shape_objs = None # Obstacle list the shapely backend's polygons were built for
+        self.shapes = None
+
+        # Temporal coherence between scans (incremental mode)
+        self.incremental = incremental
+        self.edge_cell = edge_cell
+        self.edge_grid = None # spatial_index.Edge_Grid over the edges, built on the first incremental scan
+        self.last_scan = None # (pos, num_rays, objs, backend, range, fov) the current lidar_pts were scanned with (incremental only)
+        self.ray_edges = None # Edge each ray of the last numpy scan hit (-1 for a miss)
+        self.scan_stats = {"full_rays": 0, "coherent_rays": 0, "reused_scans": 0} # Running totals of how rays were resolved
+
+    '''
+    index => optional spatial_index.Spatial_Grid built over objs. When given, only obstacles whose bounds
+    reach the LiDAR range disc (and, for the shapely backend, each individual ray) are tested
+    '''
+    # Returns the closest hit of every ray that hit something as an (N, 2) array
+    def simulate(self, num_rays, objs, index=None):
+
+        # Incremental mode: a stationary user sees the same static walls, so the previous scan is still exact
+        if self.incremental:
+            scan = (tuple(self.user.pos), num_rays, objs, self.backend, self.range, self.fov)
+            if self.last_scan is not None and self.last_scan[2] is objs and self.last_scan == scan:
+                self.scan_stats["reused_scans"] += 1
+                return self.lidar_pts.copy()
+
+            self.last_scan = scan
+
+        if self.backend == "numpy":
+            return self.simulate_numpy(num_rays, objs, index)
+        elif self.backend == "shapely":
+            return self.simulate_shapely(num_rays, objs, index)
+        elif self.backend == "sphere":
+            return self.simulate_sphere(num_rays)
+        elif self.backend == "grid":
+            return self.simulate_grid(num_rays)
+        else:
+            raise ValueError(f"Unknown LiDAR backend: {self.backend}")
+
+    # Forgets the previous scan, so the next one is computed from scratch (e.g. to time it)
+    def reset(self):
+
+        self.last_scan = None
+        self.ray_edges = None
 
-    def simulate(self, num_rays, objs):
+    def compute_ray_angles(self, num_rays):
+
+        # Same angles as the per ray loop: divides the FOV into sections
+        return np.radians(np.arange(num_rays) * (self.fov / num_rays) - (self.fov / 2))
+
+    def simulate_shapely(self, num_rays, objs, index=None):
 
         new_lidar_pts = []
         user_coord = self.user.pos
 
+        # Shapely polygons are built once per obstacle list rather than per ray
+        if self.shape_objs is not objs:
+            self.shapes = as_obst_set(objs).shapely_polys()
+            self.shape_objs = objs
+
+        if index is not None:
+            nearby_ids = index.query_disc(user_coord, self.range)
+
         for sect in range(num_rays):
             # Calculate the ray angles
             angle = math.radians(sect * (self.fov / num_rays) - (self.fov / 2)) # Divides the FOV into sections
@@ -30,10 +106,11 @@ class LiDAR_Sensor:
             closest_distance = self.range 
             closest_point = None
 
+            # Only test obstacles whose bounds overlap this ray when an index is available
+            ray_polys = self.shapes if index is None else [self.shapes[i] for i in index.filter_ray(nearby_ids, user_coord, end_point)]
+
             # Iterate through obstacles to compute intersection with the ray
-            for obj in objs:
-                # Want to use any 'stored' Shapely polygons first before having to instantiate one (processing power)
-                poly = obj.shapely_poly if hasattr(obj, 'shapely_poly') else Polygon(obj.poly)
+            for poly in ray_polys:
                 inter_poly = poly.intersection(ray_line) # Returns poly shape of intersection
                 
                 if inter_poly.is_empty:
@@ -57,17 +134,196 @@ class LiDAR_Sensor:
                             if dist < closest_distance:
                                 closest_distance = dist
                                 closest_point = pt
-                elif inter_poly.geom_type == 'LineString': # Handle the case of overlapping lines
-                    
-                    pt = inter_poly.interpolate(inter_poly.project(Point(self.user.pos)))
-                    dist = math.hypot(pt.x - user_coord[0], pt.y - user_coord[1])
-                    
-                    if dist < closest_distance:
-                        closest_distance = dist
-                        closest_point = (pt.x, pt.y)
+                elif inter_poly.geom_type in ['LineString', 'MultiLineString']: # Handle the case of overlapping lines (a concave wall can be crossed more than once)
+                    segs = inter_poly.geoms if inter_poly.geom_type == 'MultiLineString' else [inter_poly]
+                    for seg in segs:
+
+                        pt = seg.interpolate(seg.project(Point(self.user.pos)))
+                        dist = math.hypot(pt.x - user_coord[0], pt.y - user_coord[1])
+
+                        if dist < closest_distance:
+                            closest_distance = dist
+                            closest_point = (pt.x, pt.y)
 
             if closest_point is not None:
                 new_lidar_pts.append(closest_point)
 
-        self.lidar_pts = new_lidar_pts
+        self.lidar_pts = np.array(new_lidar_pts, dtype=float).reshape(-1, 2)
+        return self.lidar_pts
+
+    # Edge arrays come straight from the obstacle set (lists of objects are converted once)
+    def build_edges(self, objs):
+
+        obst_set = as_obst_set(objs)
+        self.edge_set = obst_set
+        self.edge_starts = obst_set.edge_starts
+        self.edge_vecs = obst_set.edge_vecs
+        self.edge_offsets = obst_set.offsets
+        self.edge_obj_ids = obst_set.edge_obj_ids
+        self.edge_objs = objs
+        self.edge_grid = None
+        self.ray_edges = None # Edge ids of another obstacle list mean nothing here
+
+    '''
+    Solves every ray against every edge at once
+    Ray: O + t * d for t in [0, 1] (d spans the full range), Edge: A + u * e for u in [0, 1]
+    Cross products give t = ((A - O) x e) / (d x e) and u = ((A - O) x d) / (d x e)
+    '''
+    def simulate_numpy(self, num_rays, objs, index=None):
+
+        # Obstacles are static so the edges only need to be flattened once per obstacle list
+        if self.edge_objs is not objs:
+            self.build_edges(objs)
+
+        user_coord = np.asarray(self.user.pos, dtype=float)
+        angles = self.compute_ray_angles(num_rays)
+        ray_vecs = np.column_stack((np.cos(angles), np.sin(angles))) * self.range # (R, 2)
+
+        nearby = self.nearby_edges(user_coord, index)
+        if self.inside_walls(user_coord, nearby):
+            # Like the shapely backend: every ray's hit is the user's own position (the ray starts inside the wall)
+            closest_t, closest_edge = np.zeros(num_rays), np.full(num_rays, -1)
+        elif self.incremental and self.ray_edges is not None and len(self.ray_edges) == num_rays and len(self.edge_starts) and (self.ray_edges >= 0).any():
+            # Needs at least one ray that hit an edge last scan to take candidates from
+            closest_t, closest_edge = self.search_coherent(user_coord, ray_vecs, index)
+        else:
+            closest_t, closest_edge = self.search_edges(user_coord, ray_vecs, nearby)
+            self.scan_stats["full_rays"] += num_rays
+
+        self.ray_edges = closest_edge
+
+        has_hit = np.isfinite(closest_t)
+        self.lidar_pts = user_coord + ray_vecs[has_hit] * closest_t[has_hit, None]
+        return self.lidar_pts
+
+    # True when the user stands inside a wall polygon: even-odd parity of the given edges' crossings of a ray along +x, per polygon
+    def inside_walls(self, user_coord, edge_ids):
+
+        starts = self.edge_starts if edge_ids is None else self.edge_starts[edge_ids]
+        ends = starts + (self.edge_vecs if edge_ids is None else self.edge_vecs[edge_ids])
+        obj_ids = self.edge_obj_ids if edge_ids is None else self.edge_obj_ids[edge_ids]
+
+        if len(starts) == 0:
+            return False
+
+        x, y = user_coord
+        # Half open in y so a ray through a shared vertex counts one of its two edges
+        straddles = (starts[:, 1] > y) != (ends[:, 1] > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cross_x = starts[:, 0] + (y - starts[:, 1]) * (ends[:, 0] - starts[:, 0]) / (ends[:, 1] - starts[:, 1])
+        crossings = straddles & (cross_x > x)
+
+        return bool((np.bincount(obj_ids[crossings], minlength=1) % 2).any())
+
+    # Ray parameter t of every ray/edge pair (inf where they miss). Rays (R, 1, 2) against shared edges (E, 2) or per ray edges (R, C, 2)
+    def intersect(self, user_coord, ray_vecs, edge_starts, edge_vecs):
+
+        rel = edge_starts - user_coord # A - O
+        e = edge_vecs
+        d = ray_vecs
+
+        denom = d[..., 0] * e[..., 1] - d[..., 1] * e[..., 0] # d x e
+        rel_x_e = rel[..., 0] * e[..., 1] - rel[..., 1] * e[..., 0]
+        rel_x_d = rel[..., 0] * d[..., 1] - rel[..., 1] * d[..., 0]
+
+        # Parallel edges (denom == 0) never count as hits
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = rel_x_e / denom
+            u = rel_x_d / denom
+
+        hit = (denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        return np.where(hit, t, np.inf)
+
+    # Ids of the edges of obstacles within range (None = every edge)
+    def nearby_edges(self, user_coord, index):
+
+        if index is None:
+            return None
+
+        return self.edge_set.edge_ids(index.query_disc(user_coord, self.range))
+
+    # Closest hit of each ray among the given edges, as (t, edge id) with (inf, -1) for a miss
+    def search_edges(self, user_coord, ray_vecs, edge_ids):
+
+        edge_starts = self.edge_starts if edge_ids is None else self.edge_starts[edge_ids]
+        edge_vecs = self.edge_vecs if edge_ids is None else self.edge_vecs[edge_ids]
+
+        if len(edge_starts) == 0:
+            return np.full(len(ray_vecs), np.inf), np.full(len(ray_vecs), -1)
+
+        t = self.intersect(user_coord, ray_vecs[:, None, :], edge_starts, edge_vecs) # (R, E)
+        nearest = t.argmin(axis=1)
+        closest_t = t[np.arange(len(t)), nearest]
+        closest_edge = nearest if edge_ids is None else edge_ids[nearest]
+
+        return closest_t, np.where(np.isfinite(closest_t), closest_edge, -1)
+
+    '''
+    Incremental search: each ray is first solved against a handful of candidates, the edges it and the rays on either
+    side of it hit last scan plus the edges next to those on the same ring
+    The candidate hit is then checked against every edge in the edge grid cells the ray crosses up to that hit (up to
+    the full range for a ray no candidate hit), so a wall that slid in front of it is always caught. Only rays where
+    that check finds a closer or new hit are searched in full, which keeps the result exact
+    '''
+    def search_coherent(self, user_coord, ray_vecs, index):
+
+        num_rays = len(ray_vecs)
+        rays = np.arange(num_rays)
+        prev_edges = self.ray_edges
+
+        # The ray's own edge comes first so it wins ties at shared vertices
+        hit_edges = np.column_stack((prev_edges, np.roll(prev_edges, 1), np.roll(prev_edges, -1))) # (R, 3)
+        safe = np.maximum(hit_edges, 0)
+        ring_first = self.edge_offsets[self.edge_obj_ids[safe]]
+        ring_last = self.edge_offsets[self.edge_obj_ids[safe] + 1] - 1
+        before = np.where(safe == ring_first, ring_last, safe - 1)
+        after = np.where(safe == ring_last, ring_first, safe + 1)
+
+        candidates = np.concatenate((safe, before, after), axis=1) # (R, 9)
+        valid = np.tile(hit_edges >= 0, 3)
+
+        t = self.intersect(user_coord, ray_vecs[:, None, :], self.edge_starts[candidates], self.edge_vecs[candidates])
+        t[~valid] = np.inf
+        nearest = t.argmin(axis=1)
+        closest_t = t[rays, nearest]
+        closest_edge = np.where(np.isfinite(closest_t), candidates[rays, nearest], -1)
+
+        if self.edge_grid is None:
+            self.edge_grid = spatial_index.Edge_Grid(self.edge_starts, self.edge_vecs, self.edge_cell)
+
+        # Every edge that could cross a ray before its candidate hit
+        reach = np.where(np.isfinite(closest_t), closest_t, 1.0)
+        seg_rays, seg_edges = self.edge_grid.segment_edges(np.broadcast_to(user_coord, ray_vecs.shape), user_coord + ray_vecs * reach[:, None])
+        seg_t = self.intersect(user_coord, ray_vecs[seg_rays], self.edge_starts[seg_edges], self.edge_vecs[seg_edges])
+
+        redo = np.zeros(num_rays, dtype=bool)
+        redo[seg_rays[seg_t < closest_t[seg_rays]]] = True
+        if redo.any():
+            closest_t[redo], closest_edge[redo] = self.search_edges(user_coord, ray_vecs[redo], self.nearby_edges(user_coord, index))
+
+        self.scan_stats["full_rays"] += int(redo.sum())
+        self.scan_stats["coherent_rays"] += num_rays - int(redo.sum())
+
+        return closest_t, closest_edge
+
+    # Sphere traces every ray through the precomputed distance field; cost depends on free space, not polygon count
+    def simulate_sphere(self, num_rays):
+
+        if self.distance_field is None:
+            raise ValueError("The sphere backend needs a distance field")
+
+        end_pts, hit = self.distance_field.sphere_trace(self.user.pos, self.compute_ray_angles(num_rays), self.range)
+
+        self.lidar_pts = end_pts[hit]
+        return self.lidar_pts
+
+    # Ray marches every ray through the occupancy grid; cost depends on the range in cells, not polygon count
+    def simulate_grid(self, num_rays):
+
+        if self.occupancy_grid is None:
+            raise ValueError("The grid backend needs an occupancy grid")
+
+        end_pts, hit = self.occupancy_grid.ray_march(self.user.pos, self.compute_ray_angles(num_rays), self.range)
+
+        self.lidar_pts = end_pts[hit]
         return self.lidar_pts
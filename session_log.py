@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import numpy as np
+
+# Bump whenever the column layout changes so old sessions are rejected instead of misread
+SESSION_VERSION = 1
+
+'''
+A session is a directory holding one raw little-endian binary file per column, appended to every frame
+Fixed size columns hold one row per frame. Variable length columns (lidar and curve points) are a flat stream of
+points plus a per frame point count; the replayer turns the counts into offsets
+Nothing is ever rewritten and the files are flushed every flush_interval seconds, so a run that crashes or is killed
+leaves every frame recorded up to its last flush readable (and a closed recorder every frame)
+'''
+FIXED_COLUMNS = {
+    "pos": ("<f8", (2,)), # User.pos after the frame (what was rendered)
+    "plan_pos": ("<f8", (2,)), # Position the planner ran from
+    "movement": ("u1", (4,)), # Movement flags the planner ran with (left, right, up, down)
+    "strength": ("<i2", ()), # Control strength
+}
+POINT_COLUMNS = {
+    "lidar": "<f8", # Lidar hits of the frame
+    "curve": "<f8", # Guiding curve computed by the planner
+}
+
+def column_file(path, name):
+
+    return os.path.join(path, f"{name}.bin")
+
+def read_meta(path):
+
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+
+    if meta.get("version") != SESSION_VERSION:
+        raise ValueError(f"Unsupported session version {meta.get('version')} in {path}")
+
+    return meta
+
+# Appends frames to a session directory (created if needed, refused if it already holds a session)
+class Session_Recorder:
+
+    def __init__(self, path, meta=None, flush_interval=1.0):
+
+        if os.path.exists(os.path.join(path, "meta.json")):
+            raise ValueError(f"Session already exists: {path}")
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.frames = 0
+        self.flush_interval = flush_interval # Seconds between flushes while recording (0 flushes every frame)
+        self.last_flush = time.perf_counter()
+
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"version": SESSION_VERSION, **(meta or {})}, f, indent=2)
+
+        names = list(FIXED_COLUMNS) + [f"{name}_count" for name in POINT_COLUMNS] + list(POINT_COLUMNS)
+        self.files = {name: open(column_file(path, name), "ab") for name in names}
+
+    def record(self, pos, plan_pos, movement, strength, lidar_pts, curve_pts):
+
+        row = {"pos": pos, "plan_pos": plan_pos, "movement": movement, "strength": strength}
+        for name, (dtype, shape) in FIXED_COLUMNS.items():
+            self.files[name].write(np.asarray(row[name], dtype=dtype).reshape(shape).tobytes())
+
+        for name, pts in (("lidar", lidar_pts), ("curve", curve_pts)):
+            pts = np.asarray(pts, dtype=POINT_COLUMNS[name]).reshape(-1, 2)
+            self.files[name].write(pts.tobytes())
+            self.files[f"{name}_count"].write(np.uint32(len(pts)).tobytes())
+
+        self.frames += 1
+
+        now = time.perf_counter()
+        if now - self.last_flush >= self.flush_interval:
+            self.flush()
+            self.last_flush = now
+
+    def flush(self):
+
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+'''
+Memory maps a recorded session. Only the per frame point counts are read into RAM (to build offsets), so even
+long runs can be replayed or analysed without loading them
+'''
+class Session_Replay:
+
+    def __init__(self, path):
+
+        self.path = path
+        self.meta = read_meta(path)
+
+        self.columns = {}
+        for name, (dtype, shape) in FIXED_COLUMNS.items():
+            self.columns[name] = self.map_column(name, dtype, shape)
+
+        self.offsets = {}
+        for name, dtype in POINT_COLUMNS.items():
+            counts = self.map_column(f"{name}_count", "<u4", ())
+            self.offsets[name] = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+            self.columns[name] = self.map_column(name, dtype, (2,))
+
+        # Frames every column has completely (the last one may be cut short if the recorder was killed)
+        frames = min(len(self.columns[name]) for name in FIXED_COLUMNS)
+        for name in POINT_COLUMNS:
+            complete = np.searchsorted(self.offsets[name], len(self.columns[name]), side='right') - 1
+            frames = min(frames, complete)
+        self.frames = int(frames)
+
+    # Read only memory map of one column file as (rows, *shape); whole rows only
+    def map_column(self, name, dtype, shape):
+
+        dtype = np.dtype(dtype)
+        row_bytes = dtype.itemsize * int(np.prod(shape, dtype=int))
+        path = column_file(self.path, name)
+        rows = os.path.getsize(path) // row_bytes if os.path.isfile(path) else 0
+
+        if rows == 0:
+            return np.empty((0, *shape), dtype=dtype)
+
+        return np.memmap(path, dtype=dtype, mode="r", shape=(rows, *shape))
+
+    def __len__(self):
+
+        return self.frames
+
+    def points(self, name, idx):
+
+        return self.columns[name][self.offsets[name][idx]:self.offsets[name][idx + 1]]
+
+    # One frame as a dict of arrays (views into the memory maps)
+    def frame(self, idx):
+
+        if not 0 <= idx < self.frames:
+            raise IndexError(f"Frame {idx} out of range for {self.frames} frames")
+
+        return {
+            "pos": self.columns["pos"][idx], "plan_pos": self.columns["plan_pos"][idx],
+            "movement": self.columns["movement"][idx].astype(bool), "strength": int(self.columns["strength"][idx]),
+            "lidar": self.points("lidar", idx), "curve": self.points("curve", idx),
+        }
+
+    def __iter__(self):
+
+        for idx in range(self.frames):
+            yield self.frame(idx)
@@ -0,0 +1,137 @@
+import math
+import numpy as np
+
+from obstacle import as_obst_set
+
+# Uniform grid over obstacle bounding boxes. Built once per map so each scan only touches nearby obstacles
+class Spatial_Grid:
+
+    def __init__(self, objs, cell_size=200):
+
+        self.objs = objs
+        self.cell_size = cell_size
+        self.bounds = as_obst_set(objs).bounds # (minx, miny, maxx, maxy)
+
+        # Register every obstacle in each cell its bounding box covers
+        self.cells = {}
+        for idx, (min_x, min_y, max_x, max_y) in enumerate(self.bounds):
+            for cell in self.cells_in_bounds(min_x, min_y, max_x, max_y):
+                self.cells.setdefault(cell, []).append(idx)
+
+    def cells_in_bounds(self, min_x, min_y, max_x, max_y):
+
+        for cx in range(math.floor(min_x / self.cell_size), math.floor(max_x / self.cell_size) + 1):
+            for cy in range(math.floor(min_y / self.cell_size), math.floor(max_y / self.cell_size) + 1):
+                yield (cx, cy)
+
+    # Indices of obstacles whose bounding box overlaps the given box
+    def query_bounds(self, min_x, min_y, max_x, max_y):
+
+        found = set()
+        for cell in self.cells_in_bounds(min_x, min_y, max_x, max_y):
+            found.update(self.cells.get(cell, ()))
+
+        if not found:
+            return np.empty(0, dtype=int)
+
+        ids = np.fromiter(found, dtype=int, count=len(found))
+        ids.sort()
+        b = self.bounds[ids]
+        overlap = (b[:, 0] <= max_x) & (b[:, 2] >= min_x) & (b[:, 1] <= max_y) & (b[:, 3] >= min_y)
+
+        return ids[overlap]
+
+    # Indices of obstacles whose bounding box intersects the disc (e.g. the LiDAR range around the user)
+    def query_disc(self, center, radius):
+
+        ids = self.query_bounds(center[0] - radius, center[1] - radius, center[0] + radius, center[1] + radius)
+        b = self.bounds[ids]
+
+        # Distance from the centre to the closest point of each box
+        dx = np.maximum(np.maximum(b[:, 0] - center[0], center[0] - b[:, 2]), 0)
+        dy = np.maximum(np.maximum(b[:, 1] - center[1], center[1] - b[:, 3]), 0)
+
+        return ids[dx * dx + dy * dy <= radius * radius]
+
+    # Subset of the given indices whose bounding box overlaps the bounding box of a ray/segment
+    def filter_ray(self, ids, start, end):
+
+        b = self.bounds[ids]
+        overlap = ((b[:, 0] <= max(start[0], end[0])) & (b[:, 2] >= min(start[0], end[0])) &
+                   (b[:, 1] <= max(start[1], end[1])) & (b[:, 3] >= min(start[1], end[1])))
+
+        return ids[overlap]
+
+'''
+Uniform grid over individual edges (start points plus edge vectors, as flattened by LiDAR_Sensor.build_edges)
+Stored CSR style: the edges registered in cell k are cell_edges[cell_starts[k]:cell_starts[k + 1]], with cells
+numbered row by row from the grid's first cell, so whole batches of segments are looked up with array operations
+'''
+class Edge_Grid:
+
+    def __init__(self, edge_starts, edge_vecs, cell_size=16):
+
+        self.cell_size = cell_size
+        self.num_edges = len(edge_starts)
+
+        ends = edge_starts + edge_vecs
+        first = np.floor(np.minimum(edge_starts, ends) / cell_size).astype(np.int64) # (E, 2) lowest (cx, cy) of each edge
+        last = np.floor(np.maximum(edge_starts, ends) / cell_size).astype(np.int64)
+
+        self.first_cell = first.min(axis=0) if self.num_edges else np.zeros(2, dtype=np.int64)
+        self.dims = (last.max(axis=0) - self.first_cell + 1) if self.num_edges else np.ones(2, dtype=np.int64) # (nx, ny)
+
+        # Every cell an edge's bounding box covers
+        span = last - first + 1
+        edge_ids, offsets = self.expand(span[:, 0] * span[:, 1])
+        cells = first[edge_ids] - self.first_cell + np.column_stack((offsets % span[edge_ids, 0], offsets // span[edge_ids, 0]))
+        keys = cells[:, 1] * self.dims[0] + cells[:, 0]
+
+        order = np.argsort(keys, kind="stable")
+        self.cell_edges = edge_ids[order]
+        self.cell_starts = np.searchsorted(keys[order], np.arange(self.dims[0] * self.dims[1] + 1))
+
+    # For items with the given counts: the item of every expanded entry and its position within the item
+    @staticmethod
+    def expand(counts):
+
+        items = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(len(items)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        return items, offsets
+
+    '''
+    (segment id, edge id) pairs covering every edge that can touch one of the segments (possibly more, with repeats)
+    Each segment is cut into pieces no longer than half a cell. A piece's bounding box, padded slightly so rounding
+    can't push a point on a cell border into the neighbouring cell, spans at most 2 x 2 cells, so the union of those
+    cells holds every edge that crosses the segment
+    '''
+    def segment_edges(self, starts, ends):
+
+        starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+        lengths = np.hypot(*(ends - starts).T)
+        pieces = np.maximum(np.ceil(2 * lengths / self.cell_size), 1).astype(np.int64)
+        pad = self.cell_size * 1e-6
+
+        seg_ids, piece_ids = self.expand(pieces)
+        frac = pieces[seg_ids, None].astype(float)
+        piece_starts = starts[seg_ids] + (ends - starts)[seg_ids] * (piece_ids[:, None] / frac)
+        piece_ends = starts[seg_ids] + (ends - starts)[seg_ids] * ((piece_ids[:, None] + 1) / frac)
+
+        low = np.floor((np.minimum(piece_starts, piece_ends) - pad) / self.cell_size).astype(np.int64) - self.first_cell
+        high = np.floor((np.maximum(piece_starts, piece_ends) + pad) / self.cell_size).astype(np.int64) - self.first_cell
+
+        # The four corner cells of each piece's box (repeats when it stays within a row or column)
+        cx = np.stack((low[:, 0], high[:, 0], low[:, 0], high[:, 0]), axis=1).ravel()
+        cy = np.stack((low[:, 1], low[:, 1], high[:, 1], high[:, 1]), axis=1).ravel()
+        cell_segs = np.repeat(seg_ids, 4)
+
+        inside = (cx >= 0) & (cx < self.dims[0]) & (cy >= 0) & (cy < self.dims[1])
+        keys = cy[inside] * self.dims[0] + cx[inside]
+        cell_segs = cell_segs[inside]
+
+        counts = self.cell_starts[keys + 1] - self.cell_starts[keys]
+        entries, offsets = self.expand(counts)
+
+        return cell_segs[entries], self.cell_edges[self.cell_starts[keys][entries] + offsets]
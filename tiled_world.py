@@ -0,0 +1,219 @@
+import math
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from shapely.geometry import Polygon, box
+
+from obstacle import Obst_Set
+import map_sim_gen as msgen
+import map_cache
+import spatial_index
+import ros_map
+
+'''
+A map image (binary PGM) too large to process and keep in memory as a whole, split into square tiles at its native resolution
+(one world pixel per image pixel; nothing is resized to the screen)
+Each tile runs through the Sim_Map_Generator stages on its own pixels plus a margin, so walls crossing the border
+are still detected, and keeps only the wall polygons clipped to its own square. Tiles are loaded around the user as
+they move and the least recently needed ones beyond the prefetch radius are evicted, so memory and per frame cost
+depend on the radii and tile size, not on the total map area
+'''
+
+# Wall polygons of one tile and the obstacle set built from them
+class World_Tile:
+
+    def __init__(self, key, polys):
+
+        self.key = key
+        self.polys = polys
+        self.objs = Obst_Set.from_polys(polys)
+
+class Tiled_World:
+
+    '''
+    radius => tiles within this distance of the user must be loaded before a scan (at least the LiDAR range)
+    prefetch_radius => tiles within this distance are loaded ahead of time on a worker thread and never evicted
+    max_tiles => LRU capacity; tiles beyond the prefetch radius are evicted once more than this many are loaded
+    gen_params => Sim_Map_Generator settings used for every tile (scale and screen size do not apply)
+    '''
+    def __init__(self, map_path, tile_size=512, margin=64, radius=300, prefetch_radius=600, max_tiles=25, cache_dir=".map_cache", background=True, **gen_params):
+
+        self.map_path = map_path
+        self.tile_size = tile_size
+        self.margin = margin
+        self.radius = radius
+        self.prefetch_radius = max(prefetch_radius, radius)
+        self.max_tiles = max_tiles
+        self.cache_dir = cache_dir
+
+        # Only binary PGMs are accepted: they are memory mapped, so only the pixels of loaded tiles are ever read
+        # (other formats would be decoded into memory as a whole)
+        if not map_path.lower().endswith(".pgm"):
+            raise ValueError(f"Tiled maps must be binary PGM images, convert {map_path} first")
+        self.image, _ = ros_map.read_map_image(map_path)
+        self.height, self.width = self.image.shape[:2]
+        self.tiles_x = math.ceil(self.width / tile_size)
+        self.tiles_y = math.ceil(self.height / tile_size)
+
+        self.generator = msgen.Sim_Map_Generator(map_path, cache_dir=None, **gen_params)
+        self.process_lock = threading.Lock() # The generator keeps per run state, so tiles are processed one at a time
+
+        # Polygons of every tile are cached on disk under the image's content hash and settings, computed once
+        self.cache_base = None
+        if cache_dir is not None:
+            params = {**self.generator.cache_params(), "tile_size": tile_size, "margin": margin}
+            self.cache_base = map_cache.cache_key(map_path, params)
+
+        self.tiles = OrderedDict() # (tx, ty) -> World_Tile, least recently needed first
+        self.pending = {} # (tx, ty) -> Future of tiles being prefetched
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tile-loader") if background else None
+
+        # Obstacles and index over every loaded tile, rebuilt only when the loaded set changes
+        self.objs = Obst_Set.from_polys([])
+        self.index = spatial_index.Spatial_Grid(self.objs, cell_size=radius)
+
+        self.stats = {"loaded": 0, "cached": 0, "evicted": 0, "waited": 0, "load_time": 0.0}
+
+    # Centre of the map in world pixels
+    @property
+    def center(self):
+
+        return (self.width / 2, self.height / 2)
+
+    # Keys of the tiles whose square comes within radius of pos
+    def tiles_near(self, pos, radius):
+
+        size = self.tile_size
+        first_tx = max(math.floor((pos[0] - radius) / size), 0)
+        last_tx = min(math.floor((pos[0] + radius) / size), self.tiles_x - 1)
+        first_ty = max(math.floor((pos[1] - radius) / size), 0)
+        last_ty = min(math.floor((pos[1] + radius) / size), self.tiles_y - 1)
+
+        keys = []
+        for tx in range(first_tx, last_tx + 1):
+            for ty in range(first_ty, last_ty + 1):
+                dx = max(tx * size - pos[0], pos[0] - (tx + 1) * size, 0)
+                dy = max(ty * size - pos[1], pos[1] - (ty + 1) * size, 0)
+
+                if dx * dx + dy * dy <= radius * radius:
+                    keys.append((tx, ty))
+
+        return keys
+
+    def tile_cache_path(self, key):
+
+        tile_key = hashlib.sha256(f"{self.cache_base}:{key[0]},{key[1]}".encode()).hexdigest()
+
+        return map_cache.cache_path(self.cache_dir, self.map_path, tile_key)
+
+    # Wall polygons of one tile in world pixels, from the disk cache or by running the generator on its pixels
+    def process_tile(self, key):
+
+        cache_file = self.tile_cache_path(key) if self.cache_base is not None else None
+        if cache_file is not None:
+            polys = map_cache.load_polys(cache_file)
+            if polys is not None:
+                self.stats["cached"] += 1
+                return polys
+
+        start = time.perf_counter()
+        size = self.tile_size
+        left, top = key[0] * size, key[1] * size
+        x0, y0 = max(left - self.margin, 0), max(top - self.margin, 0)
+        x1, y1 = min(left + size + self.margin, self.width), min(top + size + self.margin, self.height)
+
+        with self.process_lock:
+            pixels = np.array(self.image[y0:y1, x0:x1]) # Reads just this window of a memory mapped image
+            line_segs = self.generator.proc_array(pixels)
+            margin_polys = self.generator.lines_to_polys(line_segs)
+
+        # Back to world pixels, keeping only what lies inside this tile so neighbours don't overlap
+        core = box(left, top, left + size, top + size)
+        polys = []
+        for pts in margin_polys:
+            clipped = Polygon([(x + x0, y + y0) for (x, y) in pts]).intersection(core)
+
+            for geom in getattr(clipped, "geoms", [clipped]):
+                if geom.geom_type == "Polygon" and not geom.is_empty:
+                    polys.append(list(geom.exterior.coords))
+
+        self.stats["load_time"] += time.perf_counter() - start
+
+        if cache_file is not None:
+            map_cache.save_polys(cache_file, polys)
+
+        return polys
+
+    def load_tile(self, key):
+
+        tile = World_Tile(key, self.process_tile(key))
+        self.stats["loaded"] += 1
+
+        return tile
+
+    '''
+    Brings the loaded tiles up to date for a user at pos
+    Required tiles are loaded (or waited for) right away, prefetch tiles are queued on the worker thread
+    Returns True when the set of loaded tiles, and therefore objs and index, changed
+    '''
+    def update(self, pos):
+
+        required = self.tiles_near(pos, self.radius)
+        nearby = self.tiles_near(pos, self.prefetch_radius)
+        changed = False
+
+        # Adopt tiles the worker finished since the last update
+        for key, future in list(self.pending.items()):
+            if future.done():
+                del self.pending[key]
+                self.tiles[key] = future.result()
+                changed = True
+
+        for key in required:
+            if key not in self.tiles:
+                if key in self.pending:
+                    self.stats["waited"] += 1
+                    self.tiles[key] = self.pending.pop(key).result()
+                else:
+                    self.tiles[key] = self.load_tile(key)
+                changed = True
+
+        for key in nearby:
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+            elif key not in self.pending:
+                if self.executor is not None:
+                    self.pending[key] = self.executor.submit(self.load_tile, key)
+                else:
+                    self.tiles[key] = self.load_tile(key)
+                    changed = True
+
+        # Least recently needed first; tiles still in the prefetch radius stay
+        nearby = set(nearby)
+        for key in list(self.tiles):
+            if len(self.tiles) <= self.max_tiles:
+                break
+
+            if key not in nearby:
+                del self.tiles[key]
+                self.stats["evicted"] += 1
+                changed = True
+
+        if changed:
+            self.rebuild()
+
+        return changed
+
+    def rebuild(self):
+
+        self.objs = Obst_Set.concat([tile.objs for tile in self.tiles.values()])
+        self.index = spatial_index.Spatial_Grid(self.objs, cell_size=self.radius)
+
+    def close(self):
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
@@ -4,13 +4,21 @@ import math
 # User 
 class User:
 
-    def __init__(self, pos=(0,0), speed=10):
+    def __init__(self, pos=(0,0), speed=10, script=None):
 
         self.pos = pos
         self.speed = speed
         self.movement = [False, False, False, False]
         self.deadzone = 0.2
 
+        # Scripted users replay a movement sequence instead of polling the keyboard/joystick
+        self.script = iter(script) if script is not None else None
+        self.script_done = False
+
+        if self.script is not None:
+            self.joystick = None
+            return
+
         pygame.joystick.init()
         if pygame.joystick.get_count() > 0:
 
@@ -21,6 +29,10 @@ class User:
             self.joystick = None
 
     def input_handler(self):
+
+        if self.script is not None:
+            self.script_handler()
+            return
         
         keys = pygame.key.get_pressed()
         self.movement[0] = keys[pygame.K_LEFT]  
@@ -68,6 +80,22 @@ class User:
                 self.movement[2] = 0
                 self.movement[3] = 0
 
+    # Replace the input script (e.g. to reuse one user for several scripted runs)
+    def set_script(self, script):
+
+        self.script = iter(script)
+        self.script_done = False
+        self.movement = [False, False, False, False]
+
+    # Advance the scripted input by one frame. Stops moving once the script runs out
+    def script_handler(self):
+
+        try:
+            self.movement = [bool(m) for m in next(self.script)]
+        except StopIteration:
+            self.movement = [False, False, False, False]
+            self.script_done = True
+
     def update(self, slowdown=None):
         
         if slowdown is None:
@@ -79,4 +107,30 @@ class User:
         if self.movement[2]:  # Move up
             self.pos = (self.pos[0], self.pos[1] - self.speed * slowdown['up'])
         if self.movement[3]:  # Move down
-            self.pos = (self.pos[0], self.pos[1] + self.speed * slowdown['down'])
\ No newline at end of file
+            self.pos = (self.pos[0], self.pos[1] + self.speed * slowdown['down'])
+
+'''
+Input scripts hold one movement per line as four 0/1 flags (left, right, up, down),
+optionally followed by how many frames to hold it, e.g. "0100 120" moves right for 120 frames
+Blank lines and lines starting with # are ignored
+'''
+def load_input_script(path):
+
+    script = []
+    with open(path) as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+
+            if not line or line.startswith('#'):
+                continue
+
+            parts = line.split()
+            flags = parts[0]
+            if len(flags) != 4 or any(c not in '01' for c in flags) or len(parts) > 2:
+                raise ValueError(f"{path}:{line_num}: expected four 0/1 flags and an optional frame count, got {line!r}")
+
+            movement = [c == '1' for c in flags]
+            repeat = int(parts[1]) if len(parts) == 2 else 1
+            script.extend([movement] * repeat)
+
+    return script